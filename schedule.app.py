@@ -1,14 +1,26 @@
+import time
+RUN_T0 = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import json
 import os
 import uuid
 import calendar
-import math
-import gspread
 from datetime import datetime, timedelta
 import streamlit.components.v1 as components
-from oauth2client.service_account import ServiceAccountCredentials
+# 資料存取、快照快取、KPI 判定與統計都在 schedule_core (CLI / HTTP API 共用)
+from schedule_core import (
+    HOOKS, use_secrets, get_client, get_brands, get_brand, safe_num, get_snapshot, get_snapshot_store, refresh_brands,
+    delta_refresh_brands, start_delta_poller, changes_since,
+    merge_overlay, commit_changes, append_posts, clear_brand, brand_writable, expand_series, series_rrule_text, parse_date_list,
+    get_standards_book, load_standards, save_standards, is_metrics_disabled, get_performance_label, process_post_metrics,
+    get_capacity_index, load_capacity_limits, save_capacity_limits, check_capacity, suggest_slots, weekly_load, capacity_label, limit_for,
+    campaign_rollups, campaign_siblings, CAMPAIGN_SHARED_FIELDS,
+    filter_posts, platform_stats, brand_stats, type_crosstab, export_rows, export_columns, encode_export,
+    export_filename, export_available, new_export_path, remove_export, read_export, build_history_export, get_export_executor, get_report_executor,
+    SHEET_COLUMNS, EXPORT_FORMATS, EXPORT_REQUIRES, PLATFORMS, MAIN_POST_TYPES, SOUVENIR_SUB_TYPES, POST_PURPOSES, POST_FORMATS,
+    PROJECT_OWNERS, POST_OWNERS, DESIGNERS, WEEKDAY_NAMES, SERIES_MAX_DATES, CAPACITY_DIMS
+)
+from schedule_report import month_range, build_report_zip
 
 # --- 1. 配置與常數 ---
 st.set_page_config(
@@ -18,305 +30,47 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# ⚠️ 請填入你的 Google Sheet 網址
-SHEET_URL = "https://docs.google.com/spreadsheets/d/1Nvqid5fHkcrkOJE322Xqv_R_7kU4krc9q8us3iswRGc/edit?gid=0#gid=0" 
-STANDARDS_FILE = "social_standards.json"
-
-# Google API Scope
-SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-
-# --- 核心設定：Google Sheet 中文欄位對照表 ---
-COL_MAP = {
-    'id': 'ID',
-    'date': '日期',
-    'platform': '平台',
-    'topic': '主題',
-    'postType': '類型',
-    'postSubType': '子類型',
-    'postPurpose': '目的',
-    'postFormat': '形式',
-    'projectOwner': '專案負責人',
-    'postOwner': '貼文負責人',
-    'designer': '美編',
-    'status': '狀態',
-    # 成效數據
-    'metrics7d_reach': '7天觸及',
-    'metrics7d_likes': '7天按讚',
-    'metrics7d_comments': '7天留言',
-    'metrics7d_shares': '7天分享',
-    'metrics7d_saves': '7天收藏',    # 🔥 新增欄位
-    'metrics7d_eng': '7天互動',
-    
-    'metrics1m_reach': '30天觸及',
-    'metrics1m_likes': '30天按讚',
-    'metrics1m_comments': '30天留言',
-    'metrics1m_shares': '30天分享',
-    'metrics1m_saves': '30天收藏',   # 🔥 新增欄位
-    'metrics1m_eng': '30天互動'
-}
-
-# 選項定義
-PLATFORMS = ['Facebook', 'Instagram', 'LINE@', 'YouTube', 'Threads', '社團']
-MAIN_POST_TYPES = ['喜餅', '彌月', '伴手禮', '社群互動', '圓夢計畫', '公告']
-SOUVENIR_SUB_TYPES = ['端午節', '中秋', '聖誕', '新春', '蒙友週']
-POST_PURPOSES = ['互動', '廣告', '門市廣告', '導購', '公告']
-POST_FORMATS = ['單圖', '多圖', '假多圖', '短影音', '限動', '純文字', '留言處']
-
-# 選項 (含空白)
-PROJECT_OWNERS = ['', '夢涵', 'MOMO', '櫻樺', '季嫻', '凌萱', '宜婷', '門市']
-POST_OWNERS = ['一千', '楷曜', '可榆']
-DESIGNERS = ['', '千惟', '靖嬙']
+FAST_START = os.environ.get("SCHEDULE_FAST_START", "1") != "0"   # 先畫外框再載入資料
+POLL_SECONDS = int(os.environ.get("SCHEDULE_POLL_SECONDS", "0") or 0)   # >0 時背景差異同步並通知各 session
 
 # 樣式設定
 ICONS = {'Facebook': '📘', 'Instagram': '📸', 'LINE@': '🟢', 'YouTube': '▶️', 'Threads': '🧵', '社團': '👥'}
 PLATFORM_COLORS = {'Facebook': '#1877F2', 'Instagram': '#E1306C', 'LINE@': '#06C755', 'YouTube': '#F59E0B', 'Threads': '#000000', '社團': '#F97316'}
 PLATFORM_MARKS = {'Facebook': '🟦', 'Instagram': '🟥', 'LINE@': '🟩', 'YouTube': '🟨', 'Threads': '⬛', '社團': '🟧'}
 
-# --- 2. Google Sheets 連線與資料處理 ---
-
-def get_client():
-    try:
-        if "service_account" in st.secrets:
-            creds_dict = dict(st.secrets["service_account"])
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
-            return gspread.authorize(creds)
-        else:
-            st.error("❌ 未設定 Secrets")
-            return None
-    except Exception as e:
-        st.error(f"認證失敗: {e}")
-        return None
-
-def safe_num(val):
-    try:
-        if isinstance(val, str): val = val.replace(',', '').strip()
-        f = float(val)
-        if math.isnan(f) or math.isinf(f): return 0.0
-        return f
-    except: return 0.0
-
-def load_data():
-    client = get_client()
-    if not client: return []
-    try:
-        sheet = client.open_by_url(SHEET_URL).sheet1
-        raw_records = sheet.get_all_records()
-        
-        processed_posts = []
-        for row in raw_records:
-            def get_val(cn_key, default=""):
-                return row.get(cn_key, default)
-
-            r_topic = str(get_val('主題', '')).strip()
-            r_date = str(get_val('日期', '')).strip()
-            if not r_topic and not r_date: continue
-
-            raw_id = str(get_val('ID')).strip()
-            final_id = raw_id if raw_id else str(uuid.uuid4())
-
-            try: std_date = pd.to_datetime(r_date).strftime('%Y-%m-%d')
-            except: std_date = r_date
-
-            v_likes_7 = safe_num(get_val('7天按讚', ''))
-            if v_likes_7 == 0: v_likes_7 = safe_num(get_val('7天互動', 0))
-            
-            v_likes_30 = safe_num(get_val('30天按讚', ''))
-            if v_likes_30 == 0: v_likes_30 = safe_num(get_val('30天互動', 0))
-
-            m7 = {
-                'reach': safe_num(get_val('7天觸及', 0)),
-                'likes': v_likes_7,
-                'comments': safe_num(get_val('7天留言', 0)),
-                'shares': safe_num(get_val('7天分享', 0)),
-                'saves': safe_num(get_val('7天收藏', 0)) # 🔥 讀取收藏
-            }
-            m1 = {
-                'reach': safe_num(get_val('30天觸及', 0)),
-                'likes': v_likes_30,
-                'comments': safe_num(get_val('30天留言', 0)),
-                'shares': safe_num(get_val('30天分享', 0)),
-                'saves': safe_num(get_val('30天收藏', 0)) # 🔥 讀取收藏
-            }
-            
-            post = {
-                'id': final_id,
-                'date': std_date,
-                'platform': str(get_val('平台', 'Facebook')),
-                'topic': r_topic,
-                'postType': str(get_val('類型', '')),
-                'postSubType': str(get_val('子類型', '')),
-                'postPurpose': str(get_val('目的', '')),
-                'postFormat': str(get_val('形式', '')),
-                'projectOwner': str(get_val('專案負責人', '')),
-                'postOwner': str(get_val('貼文負責人', '')),
-                'designer': str(get_val('美編', '')),
-                'status': str(get_val('狀態', 'published')),
-                'metrics7d': m7,
-                'metrics1m': m1
-            }
-            processed_posts.append(post)
-        return processed_posts
-    except Exception as e:
-        return []
-
-def save_data(data):
-    client = get_client()
-    if not client: return
-    try:
-        sheet = client.open_by_url(SHEET_URL).sheet1
-        
-        flat_data = []
-        for p in data:
-            if not p.get('topic') and not p.get('date'): continue
-
-            m7 = p.get('metrics7d', {})
-            m1 = p.get('metrics1m', {})
-            
-            # 🔥 自動計算互動總數 (讚+留言+分享+收藏)
-            eng7 = safe_num(m7.get('likes', 0)) + safe_num(m7.get('comments', 0)) + safe_num(m7.get('shares', 0)) + safe_num(m7.get('saves', 0))
-            eng30 = safe_num(m1.get('likes', 0)) + safe_num(m1.get('comments', 0)) + safe_num(m1.get('shares', 0)) + safe_num(m1.get('saves', 0))
-
-            flat_data.append({
-                'id': str(p.get('id')).strip(),
-                'date': p.get('date'),
-                'platform': p.get('platform'),
-                'topic': p.get('topic'),
-                'postType': p.get('postType'),
-                'postSubType': p.get('postSubType'),
-                'postPurpose': p.get('postPurpose'),
-                'postFormat': p.get('postFormat'),
-                'projectOwner': p.get('projectOwner'),
-                'postOwner': p.get('postOwner'),
-                'designer': p.get('designer'),
-                'status': p.get('status', 'published'),
-                
-                'metrics7d_reach': m7.get('reach', 0), 
-                'metrics7d_likes': m7.get('likes', 0),
-                'metrics7d_comments': m7.get('comments', 0), 
-                'metrics7d_shares': m7.get('shares', 0),
-                'metrics7d_saves': m7.get('saves', 0), # 🔥 寫入收藏
-                'metrics7d_eng': eng7,
-                
-                'metrics1m_reach': m1.get('reach', 0), 
-                'metrics1m_likes': m1.get('likes', 0),
-                'metrics1m_comments': m1.get('comments', 0), 
-                'metrics1m_shares': m1.get('shares', 0),
-                'metrics1m_saves': m1.get('saves', 0), # 🔥 寫入收藏
-                'metrics1m_eng': eng30
-            })
-
-        if flat_data:
-            df = pd.DataFrame(flat_data)
-            df = df.rename(columns=COL_MAP)
-            
-            # 🔥 欄位順序：觸及 -> 互動 -> 讚 -> 留言 -> 分享 -> 收藏
-            chinese_cols_order = [
-                'ID', '日期', '平台', '主題', '類型', '子類型', '目的', '形式', 
-                '專案負責人', '貼文負責人', '美編', '狀態',
-                '7天觸及', '7天互動', '7天按讚', '7天留言', '7天分享', '7天收藏', 
-                '30天觸及', '30天互動', '30天按讚', '30天留言', '30天分享', '30天收藏'
-            ]
-            
-            for c in chinese_cols_order:
-                if c not in df.columns: df[c] = ""
-            
-            df = df[chinese_cols_order]
-            df = df.fillna("") 
-            
-            sheet.clear()
-            try: sheet.resize(rows=len(df)+2, cols=len(chinese_cols_order)) 
-            except: pass
+# --- 啟動時間量測 ---
+def mark_startup(stage):
+    # 每個 session 只記錄第一次，時間以第一次 run 開始為基準 (ms)
+    t0 = st.session_state.setdefault('startup_t0', RUN_T0)
+    timings = st.session_state.setdefault('startup_timings', {})
+    if stage not in timings: timings[stage] = (time.perf_counter() - t0) * 1000
 
-            update_data = [df.columns.values.tolist()] + df.values.tolist()
-            sheet.update(update_data)
-        else:
-            sheet.clear()
-            sheet.append_row(list(COL_MAP.values()))
+# 核心層的錯誤訊息與計時交給 Streamlit 顯示
+HOOKS['error'] = st.error
+HOOKS['mark'] = mark_startup
+mark_startup('imports')   # 模組載入完成 (CSS / session 初始化之前)
+try: use_secrets(st.secrets)
+except Exception: pass
 
-    except Exception as e:
-        st.error(f"儲存失敗: {e}")
+# --- Session 覆寫層 (共享快照見 schedule_core) ---
+def current_posts():
+    return merge_overlay(get_snapshot(), st.session_state.post_overlay)
 
-# KPI 標準
-def load_standards():
-    defaults = {'Facebook': {'type': 'tiered', 'high': {'reach': 2000, 'engagement': 100}, 'std': {'reach': 1500, 'engagement': 45}, 'low': {'reach': 1000, 'engagement': 15}},'Instagram': {'type': 'simple', 'reach': 900, 'engagement': 30},'Threads': {'type': 'reference', 'reach': 500, 'reach_label': '瀏覽', 'engagement': 50, 'engagement_label': '互動', 'rate': 0},'YouTube': {'type': 'simple', 'reach': 500, 'engagement': 20},'LINE@': {'type': 'simple', 'reach': 0, 'engagement': 0},'社團': {'type': 'simple', 'reach': 500, 'engagement': 20}}
-    if not os.path.exists(STANDARDS_FILE): return defaults
-    try:
-        with open(STANDARDS_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-    except: return defaults
+def stage_post(post): st.session_state.post_overlay[post['id']] = post
 
-def save_standards(standards):
-    with open(STANDARDS_FILE, 'w', encoding='utf-8') as f: json.dump(standards, f, ensure_ascii=False, indent=4)
+def stage_delete(post_id): st.session_state.post_overlay[post_id] = None
 
-def is_metrics_disabled(platform, fmt): return platform == 'LINE@' or fmt in ['限動', '留言處']
+def commit_overlay(force_brands=()): return commit_changes(st.session_state.post_overlay, force_brands)
 
-def get_performance_label(platform, metrics, fmt, standards):
-    if is_metrics_disabled(platform, fmt): return "🚫 不計", "gray", "此形式/平台不需計算成效"
-    reach = safe_num(metrics.get('reach', 0))
-    if reach == 0: return "-", "gray", "尚未填寫數據"
-    
-    # 🔥 互動計算包含收藏
-    eng = safe_num(metrics.get('likes', 0)) + safe_num(metrics.get('comments', 0)) + safe_num(metrics.get('shares', 0)) + safe_num(metrics.get('saves', 0))
-    
-    rate = (eng / reach) * 100
-    std = standards.get(platform, {})
-    if not std: return "-", "gray", "未設定標準"
-    label = "-"; color = "gray"; tooltip = ""
-    def check_pass(target_r, target_e):
-        target_rate = (target_e / target_r * 100) if target_r > 0 else 0
-        return (reach >= target_r) or (eng >= target_e) or (rate >= target_rate)
-    if platform == 'Facebook':
-        h = std.get('high', {'reach': 2000, 'engagement': 100})
-        s = std.get('std', {'reach': 1500, 'engagement': 45})
-        l = std.get('low', {'reach': 1000, 'engagement': 15})
-        h_rt = (h.get('engagement', 0)/h.get('reach', 1)*100) if h.get('reach', 0)>0 else 0
-        s_rt = (s.get('engagement', 0)/s.get('reach', 1)*100) if s.get('reach', 0)>0 else 0
-        l_rt = (l.get('engagement', 0)/l.get('reach', 1)*100) if l.get('reach', 0)>0 else 0
-        tooltip = f"高標: 觸及{int(h.get('reach',0))} / 互動{int(h.get('engagement',0))} (率{h_rt:.1f}%)\n標準: 觸及{int(s.get('reach',0))} / 互動{int(s.get('engagement',0))} (率{s_rt:.1f}%)\n低標: 觸及{int(l.get('reach',0))} / 互動{int(l.get('engagement',0))} (率{l_rt:.1f}%)"
-        if check_pass(h.get('reach', 2000), h.get('engagement', 100)): return "🏆 高標雙指標" if (reach >= h.get('reach') and eng >= h.get('engagement')) else ("🏆 高標觸及" if reach >= h.get('reach') else "🏆 高標互動"), "purple", tooltip
-        elif check_pass(s.get('reach', 1500), s.get('engagement', 45)): return "✅ 標準雙指標" if (reach >= s.get('reach') and eng >= s.get('engagement')) else ("✅ 標準觸及" if reach >= s.get('reach') else "✅ 標準互動"), "green", tooltip
-        elif check_pass(l.get('reach', 1000), l.get('engagement', 15)): return "🤏 低標雙指標" if (reach >= l.get('reach') and eng >= l.get('engagement')) else ("🤏 低標觸及" if reach >= l.get('reach') else "🤏 低標互動"), "orange", tooltip
-        else: return "🔴 未達標", "red", tooltip
-    elif platform in ['Instagram', 'YouTube', '社團']:
-        t_reach = std.get('reach', 0); t_eng = std.get('engagement', 0); t_rate = (t_eng / t_reach * 100) if t_reach > 0 else 0
-        tooltip = f"目標: 觸及 {int(t_reach)} / 互動 {int(t_eng)} (率{t_rate:.1f}%)"
-        if check_pass(t_reach, t_eng): return "✅ 達標", "green", tooltip
-        else: return "🔴 未達標", "red", tooltip
-    elif platform == 'Threads':
-        t_reach = std.get('reach', 500); t_eng = std.get('engagement', 50); l_reach = std.get('reach_label', '瀏覽'); l_eng = std.get('engagement_label', '互動')
-        tooltip = f"{l_reach}: {int(t_reach)} / {l_eng}: {int(t_eng)}"
-        pass_reach = reach >= t_reach; pass_eng = eng >= t_eng
-        if pass_reach and pass_eng: return "✅ 雙指標", "green", tooltip
-        elif pass_reach: return f"✅ {l_reach}", "green", tooltip
-        elif pass_eng: return f"✅ {l_eng}", "green", tooltip
-        else: return "🔴 未達標", "red", tooltip
-    return label, color, tooltip
-
-def process_post_metrics(p):
-    m7 = p.get('metrics7d', {}); m30 = p.get('metrics1m', {})
-    
-    # 🔥 互動計算包含收藏
-    r7 = safe_num(m7.get('reach', 0)); e7 = safe_num(m7.get('likes', 0)) + safe_num(m7.get('comments', 0)) + safe_num(m7.get('shares', 0)) + safe_num(m7.get('saves', 0))
-    r30 = safe_num(m30.get('reach', 0)); e30 = safe_num(m30.get('likes', 0)) + safe_num(m30.get('comments', 0)) + safe_num(m30.get('shares', 0)) + safe_num(m30.get('saves', 0))
-    
-    rate7_val = (e7 / r7 * 100) if r7 > 0 else 0; rate30_val = (e30 / r30 * 100) if r30 > 0 else 0
-    disabled = is_metrics_disabled(p.get('platform'), p.get('postFormat')); is_threads = p.get('platform') == 'Threads'
-    rate7_str = "-"; rate30_str = "-"
-    if disabled or is_threads: rate7_str = "🚫 不計"; rate30_str = "🚫 不計"
-    elif r7 > 0: rate7_str = f"{rate7_val:.1f}%"; rate30_str = f"{rate30_val:.1f}%" if r30 > 0 else "-"
-    today = datetime.now().date()
-    try: p_date = datetime.strptime(p.get('date', ''), "%Y-%m-%d").date()
-    except: p_date = today
-    
-    weekdays_tw = ["(一)", "(二)", "(三)", "(四)", "(五)", "(六)", "(日)"]
-    wd = weekdays_tw[p_date.weekday()]
-    date_display = f"{p.get('date', '')} {wd}"
+def commit_new_posts(new_posts):
+    # 失敗時這批不留在 overlay：表單內容保留，重按儲存不會重複新增
+    overlay = st.session_state.post_overlay
+    append_posts(new_posts, overlay)
+    failed = [p['id'] for p in new_posts if p['id'] in overlay]
+    for pid in failed: overlay.pop(pid)
+    return not failed
 
-    # 🔥 警示邏輯: 7天=🔔, 30天=⏰
-    bell7 = False; bell30 = False
-    if not disabled: 
-        if today >= (p_date + timedelta(days=7)) and r7 == 0: bell7 = True
-        if today >= (p_date + timedelta(days=30)) and r30 == 0: bell30 = True
-    return {**p, 'r7': int(r7), 'e7': int(e7), 'rate7_val': rate7_val, 'rate7_str': rate7_str, 'bell7': bell7, 'r30': int(r30), 'e30': int(e30), 'rate30_val': rate30_val, 'rate30_str': rate30_str, 'bell30': bell30, '_sort_date': p.get('date', str(today)), 'date_display': date_display}
+def clear_all_posts(brand_name): return clear_brand(brand_name, st.session_state.post_overlay)
 
 def edit_post_callback(post):
     st.session_state.editing_post = post; st.session_state.scroll_to_top = True
@@ -348,18 +102,21 @@ def edit_post_callback(post):
     st.session_state['entry_m1_saves'] = safe_num(m1.get('saves', 0)) # 🔥 讀取收藏
 
 def delete_post_callback(post_id):
-    st.session_state.posts = [item for item in st.session_state.posts if item['id'] != post_id]
-    save_data(st.session_state.posts)
+    stage_delete(post_id)
+    commit_overlay()
 
 def go_to_post_from_calendar(post_id):
     st.session_state.view_mode_radio = "📋 列表模式"; st.session_state.target_scroll_id = post_id; st.session_state.scroll_to_list_item = True 
 
 def reset_filters():
-    st.session_state.filter_platform = []; st.session_state.filter_owner = []; st.session_state.filter_post_type = []; st.session_state.filter_purpose = []; st.session_state.filter_format = []; st.session_state.filter_topic_keyword = ""
+    st.session_state.filter_brand = []; st.session_state.filter_platform = []; st.session_state.filter_owner = []; st.session_state.filter_post_type = []; st.session_state.filter_purpose = []; st.session_state.filter_format = []; st.session_state.filter_topic_keyword = ""
 
 # --- Init State ---
-if 'posts' not in st.session_state: st.session_state.posts = load_data()
-if 'standards' not in st.session_state: st.session_state.standards = load_standards()
+if 'post_overlay' not in st.session_state: st.session_state.post_overlay = {}
+# 🔥 KPI 標準版本簿：檔案 mtime 變動 (其他人儲存) 時自動重新載入
+standards_book = get_standards_book()
+if 'standards' not in st.session_state or st.session_state.get('standards_mtime') != standards_book['mtime']:
+    st.session_state.standards = load_standards(); st.session_state.standards_mtime = standards_book['mtime']
 if 'editing_post' not in st.session_state: st.session_state.editing_post = None
 if 'scroll_to_top' not in st.session_state: st.session_state.scroll_to_top = False
 if 'target_scroll_id' not in st.session_state: st.session_state.target_scroll_id = None
@@ -394,21 +151,79 @@ st.markdown(f"""
     .cal-day-header {{ text-align: center; font-weight: bold; color: #6b7280; border-bottom: 1px solid #e5e7eb; padding-bottom: 2px; margin-bottom: 2px; font-size: 0.9em; }}
     .cal-day-cell {{ min-height: 60px; padding: 2px; border-radius: 4px; font-size: 0.8em; border: 1px solid #f3f4f6; }}
     .cal-day-num {{ font-weight: bold; font-size: 0.9em; color: #374151; margin-bottom: 2px; margin-left: 2px; }}
+    @keyframes skeleton-pulse {{ 0% {{ opacity: 1; }} 50% {{ opacity: 0.4; }} 100% {{ opacity: 1; }} }}
+    .skeleton-row {{ height: 38px; margin: 6px 0; border-radius: 6px; background-color: #f3f4f6; animation: skeleton-pulse 1.2s ease-in-out infinite; }}
     {cal_btn_css}
     </style>
 """, unsafe_allow_html=True)
 
+# --- 4. 快速啟動：先畫外框 (header / sidebar / tabs / 骨架列表)，再連線載入資料 ---
+if FAST_START and not get_snapshot_store()['loaded'] and not st.session_state.get('startup_shell_shown'):
+    st.session_state.startup_shell_shown = True
+    with st.sidebar:
+        st.title("🔎 篩選條件")
+        st.caption("⏳ 正在連線 Google Sheet…")
+    st.header("📅 社群排程與成效")
+    sk_tab1, sk_tab2 = st.tabs(["🗓️ 排程管理", "📊 數據分析"])
+    with sk_tab1:
+        for _ in range(8): st.markdown("<div class='skeleton-row'></div>", unsafe_allow_html=True)
+    with sk_tab2: st.caption("⏳ 載入中…")
+    mark_startup('shell')
+    get_snapshot()
+    st.rerun()
+
+posts = current_posts()
+st.session_state.seen_version = get_snapshot()['version']   # 本次畫面已包含的快照版本 (通知用)
+brands = get_brands()
+brand_names = [b['name'] for b in brands]
+multi_brand = len(brands) > 1
+
 # --- 5. Sidebar ---
 with st.sidebar:
-    if st.button("🔄 同步雲端"):
-        st.session_state.posts = load_data()
-        st.success("已更新！")
+    # 🔥 差異同步：只抓 ID、日期、主題、雜湊四欄，再取回變動的列；手動改 Sheet 不會更新雜湊，需要時用完整同步
+    c_sync, c_full = st.columns(2)
+    if c_sync.button("🔄 同步雲端", use_container_width=True):
+        summary, errors = delta_refresh_brands(brands)
+        # 部分品牌失敗時其餘品牌照樣更新；失敗原因存到 rerun 後顯示
+        if summary:
+            deltas = [v for v in summary.values() if v is not None]; n_full = len(summary) - len(deltas)
+            st.session_state.sync_notice = f"已更新！{sum(c for c, _ in deltas)} 筆變動" + (f"、{sum(r for _, r in deltas)} 筆刪除" if any(r for _, r in deltas) else "") + (f" ({n_full} 個品牌完整下載)" if n_full else "")
+        st.session_state.sync_errors = errors
         st.rerun()
+    if c_full.button("⤵️ 完整同步", use_container_width=True, help="重新下載整張 Sheet (手動修改過 Sheet 時使用)"):
+        if not refresh_brands(brands):
+            st.session_state.sync_notice = "已完整更新！"
+            st.rerun()
+    if st.session_state.get('sync_notice'): st.success(st.session_state.pop('sync_notice'))
+    for name, err in st.session_state.pop('sync_errors', {}).items(): st.error(f"❌ {name} 同步失敗: {err}")
+
+    if POLL_SECONDS > 0:
+        start_delta_poller(POLL_SECONDS)
+        @st.fragment(run_every=POLL_SECONDS)
+        def change_notice():
+            notes = changes_since(st.session_state.get('seen_version', 0))
+            if notes:
+                st.info("🔔 雲端有更新：" + "、".join(f"{c['brand']} {c['changed']} 筆" + (f" / 刪除 {c['removed']} 筆" if c['removed'] else "") for c in notes))
+                if st.button("🔄 載入最新", key='notice_reload', use_container_width=True): st.rerun(scope='app')
+        change_notice()
+
+    # 部分品牌載入失敗/逾時時，其餘品牌照常顯示
+    for name, err in get_snapshot_store()['errors'].items():
+        st.warning(f"⚠️ {name} 載入失敗: {err}")
+
+    if st.session_state.post_overlay:
+        st.warning(f"⚠️ 有 {len(st.session_state.post_overlay)} 筆修改尚未寫入雲端")
+        c_retry, c_drop = st.columns(2)
+        if c_retry.button("💾 重新儲存", use_container_width=True):
+            if commit_overlay(): st.rerun()
+        if c_drop.button("↩️ 捨棄修改", use_container_width=True):
+            st.session_state.post_overlay = {}; st.rerun()
 
     st.title("🔎 篩選條件")
     if st.button("🧹 重置所有篩選", use_container_width=True):
         reset_filters(); st.rerun()
         
+    filter_brand = st.multiselect("品牌", brand_names, key='filter_brand') if multi_brand else []
     filter_platform = st.multiselect("平台", ["All"] + PLATFORMS, key='filter_platform')
     filter_owner = st.multiselect("負責人", ["All"] + POST_OWNERS, key='filter_owner')
     filter_post_type = st.multiselect("貼文類型", ["All"] + MAIN_POST_TYPES, key='filter_post_type')
@@ -420,7 +235,7 @@ with st.sidebar:
     date_filter_type = st.radio("日期模式", ["月", "自訂範圍"], horizontal=True, key='date_filter_type')
     
     if date_filter_type == "月":
-        all_months = set([p['date'][:7] for p in st.session_state.posts if p.get('date')])
+        all_months = set([p['date'][:7] for p in posts if p.get('date')])
         now = datetime.now()
         current_month_str = now.strftime("%Y-%m")
         all_months.add(current_month_str)
@@ -438,28 +253,35 @@ with st.sidebar:
     # --- 🔥 危險區域 (按鈕名稱修正) ---
     with st.expander("⚠️ 管理員專區 (危險操作)"):
         st.warning("請謹慎操作，動作會直接影響 Google Sheet！")
+        admin_brands = [n for n in brand_names if brand_writable(n)]
+        admin_brand = st.selectbox("操作品牌", admin_brands, key='admin_brand') if multi_brand else (admin_brands[0] if admin_brands else None)
+        if admin_brand is None: st.caption("沒有已成功載入的品牌，請先同步")
         
-        if st.button("🔨 重製標題"): # 修正：重製標題
+        if st.button("🔨 重製標題", disabled=admin_brand is None): # 修正：重製標題
             try:
                 client = get_client()
                 if client:
-                    sheet = client.open_by_url(SHEET_URL).sheet1
+                    sheet = client.open_by_url(get_brand(admin_brand)['url']).sheet1
                     # 🔥 欄位包含「收藏」
-                    chinese_cols_order = ['ID', '日期', '平台', '主題', '類型', '子類型', '目的', '形式', '專案負責人', '貼文負責人', '美編', '狀態', '7天觸及', '7天互動', '7天按讚', '7天留言', '7天分享', '7天收藏', '30天觸及', '30天互動', '30天按讚', '30天留言', '30天分享', '30天收藏']
-                    sheet.clear(); sheet.append_row(chinese_cols_order)
+                    sheet.clear(); sheet.append_row(SHEET_COLUMNS)
                     st.success("已重置標題 (含收藏欄位)！")
             except Exception as e: st.error(f"失敗: {e}")
             
         st.write("")
 
-        if st.button("🔄 回寫成效"): # 修正：回寫成效
-            save_data(st.session_state.posts)
-            st.success("已將所有資料的「互動數」重新計算並寫回 Google Sheet！")
+        if st.button("🔄 回寫成效", disabled=admin_brand is None): # 修正：回寫成效
+            if commit_overlay(force_brands=[admin_brand]): st.success("已將所有資料的「互動數」重新計算並寫回 Google Sheet！")
 
         st.write("")
 
-        if st.button("🧨 確認清空所有資料", type="primary"):
-            st.session_state.posts = []; save_data([]); st.success("資料已清空！"); st.rerun()
+        if st.button("🧨 確認清空所有資料", type="primary", disabled=admin_brand is None):
+            if clear_all_posts(admin_brand): st.success("資料已清空！"); st.rerun()
+
+    timings = st.session_state.get('startup_timings', {})
+    if timings:
+        with st.expander("⏱️ 啟動效能"):
+            stage_names = {'imports': '模組載入', 'shell': '首次繪製 (外框)', 'auth': '認證', 'fetch': '下載並解析 Sheet', 'parse': '建立快照', 'full': '完整畫面'}
+            for k, v in timings.items(): st.caption(f"{stage_names.get(k, k)}: {v:,.0f} ms")
 
 # --- 6. Main Page ---
 st.header("📅 社群排程與成效")
@@ -501,6 +323,13 @@ with tab1:
         for k in ['entry_m7_reach', 'entry_m7_likes', 'entry_m7_comments', 'entry_m7_shares', 'entry_m7_saves', 'entry_m1_reach', 'entry_m1_likes', 'entry_m1_comments', 'entry_m1_shares', 'entry_m1_saves']:
              if k not in st.session_state: st.session_state[k] = 0.0
 
+        # 載入失敗 / 逾時的品牌不能寫入 (快照是空的或舊的)，不列入選項
+        if is_edit: f_brand = st.session_state.editing_post.get('brand', brand_names[0])
+        elif multi_brand: f_brand = st.selectbox("品牌", [n for n in brand_names if brand_writable(n)], key="entry_brand")
+        else: f_brand = brand_names[0]
+        can_save = f_brand is not None and brand_writable(f_brand)
+        if not can_save: st.warning(f"⚠️ {f_brand or '品牌'} 尚未成功載入，暫時無法儲存 (請先同步)")
+
         c1, c2, c3 = st.columns([1, 2, 1])
         f_date = c1.date_input("發布日期", key="entry_date")
         if is_edit:
@@ -510,6 +339,21 @@ with tab1:
             selected_platforms = c2.multiselect("平台 (可複選)", PLATFORMS, key="entry_platform_multi")
         f_topic = c3.text_input("主題", key="entry_topic")
 
+        # 🔥 週期系列：依星期/區間展開多個日期，搭配多平台一次建立
+        series_dates = None
+        if not is_edit and st.checkbox("🔁 週期系列 (每週重複)", key="entry_series"):
+            if 'entry_series_until' not in st.session_state: st.session_state.entry_series_until = f_date + timedelta(weeks=4)
+            if 'entry_series_weekdays' not in st.session_state: st.session_state.entry_series_weekdays = [f_date.weekday()]
+            s1, s2, s3, s4 = st.columns([1, 2, 1, 2])
+            f_until = s1.date_input("重複至", key="entry_series_until")
+            f_weekdays = s2.multiselect("重複星期", list(range(7)), format_func=lambda i: WEEKDAY_NAMES[i], key="entry_series_weekdays")
+            f_interval = s3.number_input("每幾週", min_value=1, max_value=8, step=1, key="entry_series_interval")
+            f_skip = s4.text_input("略過日期 (逗號分隔)", placeholder="2025-06-10, 2025-06-17", key="entry_series_skip")
+            skip_dates, bad_dates = parse_date_list(f_skip)
+            if bad_dates: st.warning(f"無法辨識的日期: {', '.join(bad_dates)}")
+            series_dates = expand_series(f_date, f_until, set(f_weekdays), int(f_interval), skip_dates)
+            st.caption(f"規則: `{series_rrule_text(f_until, f_weekdays, int(f_interval))}`")
+
         c4, c5, c6 = st.columns(3)
         f_type = c4.selectbox("貼文類型", MAIN_POST_TYPES, key="entry_type")
         f_subtype = c5.selectbox("子類型", ["-- 無 --"] + SOUVENIR_SUB_TYPES, disabled=(f_type != '伴手禮'), key="entry_subtype")
@@ -533,12 +377,42 @@ with tab1:
         f_owner = c10.selectbox("貼文負責人", POST_OWNERS, key="entry_owner")
         f_designer = c11.selectbox("美編", DESIGNERS, key="entry_designer")
 
+        # 🔥 活動群組：同一活動的其他平台可一起改日期 / 主題 / 負責人 (一次 batch 寫回)
+        siblings = campaign_siblings(posts, st.session_state.editing_post) if is_edit else []
+        group_apply = bool(siblings) and st.checkbox(f"🔗 同步套用到同活動其他 {len(siblings)} 篇 ({'、'.join(s['platform'] for s in siblings)})：日期、主題、類型、負責人、美編", value=True, key=f"entry_group_apply_{target_edit_id}")
+
+        # 🔥 撞期檢查：依 日期 × 負責人 / 美編 / 平台 索引即時比對上限
+        cap_limits = load_capacity_limits()
+        cap_idx = get_capacity_index(get_snapshot(), st.session_state.post_overlay)
+        cap_drafts = [{'brand': f_brand, 'date': d.strftime("%Y-%m-%d"), 'platform': p, 'postPurpose': platform_purposes.get(p, ''), 'postOwner': f_owner, 'designer': f_designer} for d in (series_dates or [f_date]) for p in selected_platforms]
+        cap_exclude = {target_edit_id} if is_edit else set()
+        if group_apply:
+            cap_drafts += [{**sib, 'date': f_date.strftime("%Y-%m-%d"), 'postOwner': f_owner, 'designer': f_designer} for sib in siblings]
+            cap_exclude |= {sib['id'] for sib in siblings}
+        conflicts = check_capacity(cap_idx, cap_limits, cap_drafts, cap_exclude)
+        for c_date, c_dim, c_val, c_n, c_limit in conflicts[:5]:
+            st.warning(f"⚠️ {c_date} {CAPACITY_DIMS[c_dim]}「{capacity_label(c_dim, c_val)}」將有 {c_n} 篇 (每日上限 {c_limit})")
+        if len(conflicts) > 5: st.caption(f"…還有 {len(conflicts) - 5} 項超出上限")
+        if conflicts and series_dates is None:
+            slots = suggest_slots(cap_idx, cap_limits, cap_drafts, f_date, exclude_ids=cap_exclude)
+            st.caption("💡 最近可排日期：" + ("、".join(f"{d.strftime('%m/%d')} {WEEKDAY_NAMES[d.weekday()]}" for d in slots) if slots else "30 天內沒有空檔"))
+
+        if series_dates is not None:
+            n_posts = len(series_dates) * len(selected_platforms)
+            st.markdown(f"**🔍 預覽：{len(series_dates)} 個日期 × {len(selected_platforms)} 個平台 = {n_posts} 篇**")
+            if len(series_dates) > SERIES_MAX_DATES: st.error(f"日期超過 {SERIES_MAX_DATES} 個，請縮短範圍")
+            elif n_posts:
+                preview = [{'日期': f"{d.strftime('%Y-%m-%d')} {WEEKDAY_NAMES[d.weekday()]}", '平台': p, '目的': platform_purposes.get(p, ''), '主題': f_topic} for d in series_dates for p in selected_platforms]
+                st.dataframe(preview, use_container_width=True, hide_index=True, height=min(35 * (len(preview) + 1) + 3, 300))
+
         st.divider()
         current_platform = selected_platforms[0] if selected_platforms else 'Facebook'
         hide_metrics = is_metrics_disabled(current_platform, f_format)
         metrics_input = {'metrics7d': {}, 'metrics1m': {}}
         
-        if not hide_metrics:
+        if series_dates is not None:
+            st.info("ℹ️ 週期系列為未來排程，不需填寫成效數據")
+        elif not hide_metrics:
             st.caption("數據填寫 (互動 = 讚 + 留言 + 分享 + 收藏)")
             m_cols = st.columns(2)
             with m_cols[0]:
@@ -563,46 +437,57 @@ with tab1:
         else:
             st.info(f"ℹ️ {current_platform} / {f_format} 不需要填寫成效數據")
 
-        submitted = st.button("💾 儲存貼文", type="primary", use_container_width=True)
+        submitted = st.button("💾 儲存貼文", type="primary", use_container_width=True, disabled=not can_save)
         if submitted:
             if not f_topic: st.error("請填寫主題")
+            elif series_dates is not None and not (series_dates and selected_platforms): st.error("週期設定沒有產生任何貼文")
+            elif series_dates is not None and len(series_dates) > SERIES_MAX_DATES: st.error(f"日期超過 {SERIES_MAX_DATES} 個，請縮短範圍")
             else:
                 date_str = f_date.strftime("%Y-%m-%d")
-                target_new_id = None
+                target_new_id = None; saved = True
                 if is_edit:
                     p = selected_platforms[0]
                     base = {'date': date_str, 'topic': f_topic, 'postType': f_type, 'postSubType': f_subtype if f_subtype != "-- 無 --" else "", 'postPurpose': platform_purposes[p], 'postFormat': f_format, 'projectOwner': f_po, 'postOwner': f_owner, 'designer': f_designer, 'status': 'published', 'metrics7d': metrics_input['metrics7d'], 'metrics1m': metrics_input['metrics1m']}
                     
-                    found = False
-                    for i, d in enumerate(st.session_state.posts):
-                        if str(d['id']).strip() == str(target_edit_id).strip():
-                            st.session_state.posts[i] = {**d, **base, 'platform': p}
-                            found = True
-                            break
+                    # 🔥 不就地修改共享快照，改寫入本 session 的 overlay
+                    original = next((d for d in posts if str(d['id']).strip() == str(target_edit_id).strip()), None)
+                    if original is not None:
+                        stage_post({**original, **base, 'platform': p})
+                        if group_apply:
+                            for sib in siblings: stage_post({**sib, **{k: base[k] for k in CAMPAIGN_SHARED_FIELDS}})
                     
-                    if not found:
+                    if original is None:
                         st.error("❌ 找不到原始資料 ID，無法更新")
                     else:
                         st.session_state.editing_post = None
                         st.session_state.target_scroll_id = target_edit_id
                         st.success("已更新！")
+                    commit_overlay()
                 else:
-                    for p in selected_platforms:
+                    new_posts = []
+                    # 🔥 多平台同時建立 → 同一天的各平台共用一個活動ID
+                    campaign_ids = {d: (uuid.uuid4().hex[:8] if len(selected_platforms) > 1 else "") for d in (series_dates or [f_date])}
+                    for d, p in [(d, p) for d in (series_dates or [f_date]) for p in selected_platforms]:
                         new_id = str(uuid.uuid4())
-                        target_new_id = new_id
-                        new_p = {'id': new_id, 'date': date_str, 'platform': p, 'topic': f_topic, 'postType': f_type, 'postSubType': f_subtype if f_subtype != "-- 無 --" else "", 'postPurpose': platform_purposes[p], 'postFormat': f_format, 'projectOwner': f_po, 'postOwner': f_owner, 'designer': f_designer, 'status': 'published', 'metrics7d': metrics_input['metrics7d'], 'metrics1m': metrics_input['metrics1m']}
+                        if target_new_id is None: target_new_id = new_id
+                        new_p = {'id': new_id, 'brand': f_brand, 'date': d.strftime("%Y-%m-%d"), 'platform': p, 'topic': f_topic, 'postType': f_type, 'postSubType': f_subtype if f_subtype != "-- 無 --" else "", 'postPurpose': platform_purposes[p], 'postFormat': f_format, 'projectOwner': f_po, 'postOwner': f_owner, 'designer': f_designer, 'status': 'published', 'metrics7d': metrics_input['metrics7d'], 'metrics1m': metrics_input['metrics1m'], 'campaignId': campaign_ids[d]}
                         if is_metrics_disabled(p, f_format): new_p['metrics7d'] = {}; new_p['metrics1m'] = {}
-                        st.session_state.posts.append(new_p)
-                    st.session_state.target_scroll_id = target_new_id
-                    st.success("已新增！")
+                        new_posts.append(new_p)
+                    # 🔥 所有平台 × 日期一次 append
+                    saved = commit_new_posts(new_posts)
+                    if saved:
+                        st.session_state.target_scroll_id = target_new_id
+                        st.success(f"已新增 {len(new_posts)} 篇！")
+                    else: st.error("❌ 新增失敗，表單內容已保留，可稍後再按一次儲存")
                 
-                save_data(st.session_state.posts)
-                st.session_state.view_mode_radio = "📋 列表模式"
-                st.session_state.scroll_to_list_item = True
-                
-                for key in st.session_state.keys():
-                    if key.startswith("entry_") or key.startswith("purpose_for_"): del st.session_state[key]
-                st.rerun()
+                # 新增失敗時不清表單、不 rerun，錯誤訊息留在畫面上
+                if saved:
+                    st.session_state.view_mode_radio = "📋 列表模式"
+                    st.session_state.scroll_to_list_item = True
+                    
+                    for key in st.session_state.keys():
+                        if key.startswith("entry_") or key.startswith("purpose_for_"): del st.session_state[key]
+                    st.rerun()
 
         if st.session_state.editing_post:
             if st.button("取消編輯"):
@@ -612,18 +497,9 @@ with tab1:
                 st.rerun()
 
     # --- Filter Logic ---
-    filtered_posts = st.session_state.posts
-    if date_filter_type == "月":
-        filtered_posts = [p for p in filtered_posts if p.get('date', '').startswith(selected_month)]
-    else:
-        filtered_posts = [p for p in filtered_posts if start_date <= datetime.strptime(p.get('date', str(datetime.now().date())), "%Y-%m-%d").date() <= end_date]
-    
-    if filter_platform: filtered_posts = [p for p in filtered_posts if p['platform'] in filter_platform]
-    if filter_owner: filtered_posts = [p for p in filtered_posts if p['postOwner'] in filter_owner]
-    if filter_topic_keyword: filtered_posts = [p for p in filtered_posts if filter_topic_keyword.lower() in p['topic'].lower()]
-    if filter_post_type: filtered_posts = [p for p in filtered_posts if p['postType'] in filter_post_type]
-    if filter_purpose: filtered_posts = [p for p in filtered_posts if p['postPurpose'] in filter_purpose]
-    if filter_format: filtered_posts = [p for p in filtered_posts if p['postFormat'] in filter_format]
+    if date_filter_type == "月": date_args = {'month': selected_month}
+    else: date_args = {'start': start_date, 'end': end_date}
+    filtered_posts = filter_posts(posts, brands=filter_brand, platforms=filter_platform, owners=filter_owner, post_types=filter_post_type, purposes=filter_purpose, formats=filter_format, keyword=filter_topic_keyword, **date_args)
 
     # --- View Mode ---
     view_mode = st.radio("檢視模式", ["📋 列表模式", "🗓️ 日曆模式"], horizontal=True, label_visibility="collapsed", key="view_mode_radio")
@@ -674,7 +550,7 @@ with tab1:
                                 mark = PLATFORM_MARKS.get(p['platform'], '🟦')
                                 label = f"{mark} {label_prefix}{p['topic'][:4]}.."
                                 
-                                if st.button(label, key=f"cal_{p['id']}_{date_s}_{idx}", help=f"{p['platform']} - {p['topic']}", on_click=go_to_post_from_calendar, args=(p['id'],)): pass
+                                if st.button(label, key=f"cal_{p['id']}_{date_s}_{idx}", help=f"{p.get('brand', '') + ' / ' if multi_brand else ''}{p['platform']} - {p['topic']}", on_click=go_to_post_from_calendar, args=(p['id'],)): pass
     
     # --- List View ---
     else:
@@ -709,7 +585,7 @@ with tab1:
             today_s = datetime.now().strftime("%Y-%m-%d")
 
             for idx, p in enumerate(processed_data):
-                label, color, tooltip = get_performance_label(p['platform'], p.get('metrics7d'), p['postFormat'], st.session_state.standards)
+                label, color, tooltip = get_performance_label(p['platform'], p.get('metrics7d'), p['postFormat'], standards_book, p['date'])
                 is_today = (p['date'] == today_s)
                 is_target = (st.session_state.target_scroll_id == p['id'])
                 
@@ -724,7 +600,9 @@ with tab1:
                     c[0].markdown(f"<span class='row-text-lg'>{p['date_display']}</span>", unsafe_allow_html=True)
                     pf_clr = PLATFORM_COLORS.get(p['platform'], '#888')
                     c[1].markdown(f"<span class='platform-badge-box' style='background-color:{pf_clr}'>{p['platform']}</span>", unsafe_allow_html=True)
-                    c[2].markdown(f"<span class='row-text-lg'>{p['topic']}</span>", unsafe_allow_html=True)
+                    brand_tag = f"<span style='color:#6b7280; font-size:0.8em;'>[{p.get('brand', '')}]</span> " if multi_brand else ""
+                    if p.get('campaignId'): brand_tag += f"<span style='color:#6b7280; font-size:0.8em;' title='活動 {p['campaignId']}'>🔗</span> "
+                    c[2].markdown(f"{brand_tag}<span class='row-text-lg'>{p['topic']}</span>", unsafe_allow_html=True)
                     c[3].write(p['postType'])
                     c[4].write(p['postPurpose'])
                     c[5].write(p['postFormat'])
@@ -762,18 +640,35 @@ with tab1:
                         dc[2].metric(f"{w30}30天-{rl}", f"{p['r30']:,}")
                         dc[3].metric(f"{w30}30天-互動", f"{p['e30']:,}")
                     st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Export CSV (中文)
-            display_data = processed_data
-            export_df = pd.DataFrame(display_data)
-            export_df = export_df.rename(columns=COL_MAP)
-            final_cols = [c for c in COL_MAP.values() if c in export_df.columns]
-            csv = export_df[final_cols].to_csv(index=False).encode('utf-8-sig')
-            st.download_button("📥 匯出 CSV", csv, f"social_posts_{datetime.now().strftime('%Y%m%d')}.csv", "text/csv")
 
         else:
             st.info("目前沒有符合條件的排程資料。")
 
+        # 🔥 匯出：按下下載時才編碼 (callable)，session 不保留檔案內容
+        with st.expander("📥 匯出資料"):
+            ex_fmt = st.radio("格式", list(EXPORT_FORMATS), horizontal=True, key='export_format')
+            if not export_available(ex_fmt): st.error(f"缺少套件 {EXPORT_REQUIRES[ex_fmt]}，無法匯出 {ex_fmt}")
+            elif processed_data:
+                st.download_button(f"📥 下載篩選結果 {ex_fmt} ({len(processed_data)} 筆)", lambda rows=processed_data, fmt=ex_fmt: encode_export(export_rows(rows), export_columns(), fmt), export_filename('social_posts', ex_fmt), EXPORT_FORMATS[ex_fmt][1], key='export_download', on_click='ignore')
+
+            # 完整歷史在背景寫入 .schedule_cache/exports，session 只記路徑
+            st.markdown("**🗄️ 完整歷史 (所有貼文、所有欄位)**")
+            job = st.session_state.get('history_export_job')
+            running = job is not None and not job['future'].done()
+            if st.button("🚀 背景產生完整歷史", key='history_export_start', disabled=running or not export_available(ex_fmt)):
+                if job: remove_export(job['path'])
+                snap = get_snapshot(); path = new_export_path(ex_fmt)
+                job = st.session_state.history_export_job = {'fmt': ex_fmt, 'count': len(snap['posts']), 'path': path, 'future': get_export_executor().submit(build_history_export, snap['posts'], ex_fmt, standards_book, path)}
+                running = True
+            if job:
+                if running:
+                    st.info(f"⏳ 背景產生中 ({job['count']} 筆 {job['fmt']})…")
+                    st.button("🔄 檢查進度", key='history_export_poll')
+                elif job['future'].exception() is not None: st.error(f"匯出失敗: {job['future'].exception()}")
+                elif not os.path.exists(job['path']): st.caption("匯出檔已過期，請重新產生")
+                else:
+                    st.download_button(f"📥 下載完整歷史 {job['fmt']}", lambda path=job['path']: read_export(path), export_filename('social_posts_history', job['fmt']), EXPORT_FORMATS[job['fmt']][1], key='history_export_download', on_click='ignore')
+
 # === TAB 2 ===
 with tab2:
     with st.expander("⚙️ KPI 標準設定"):
@@ -840,9 +735,29 @@ with tab2:
             std['社團']['reach'] = grp_reach
             std['社團']['engagement'] = grp_eng
         
+        # 🔥 依生效日期存成新版本；生效日之前的貼文仍以舊標準判定
+        s1, s2 = st.columns([1, 3])
+        std_effective = s1.date_input("生效日期", value=datetime.now().date(), key='standards_effective')
+        s2.caption("已存版本 (生效日)：" + "、".join(standards_book['starts']))
         if st.button("儲存設定"):
             st.session_state.standards = std
-            save_standards(std)
+            standards_book = save_standards(std, std_effective)
+            st.session_state.standards_mtime = standards_book['mtime']
+            st.success(f"已更新！自 {std_effective} 起生效")
+
+    with st.expander("⚙️ 工作量上限設定 (每日篇數，0 = 不限)"):
+        cap = load_capacity_limits()
+        new_cap = {dim: {'*': cap[dim].get('*', 0)} for dim in CAPACITY_DIMS}
+        k1, k2, k3, k4 = st.columns(4)
+        for col, dim, names in [(k1, 'postOwner', POST_OWNERS), (k2, 'designer', [d for d in DESIGNERS if d]), (k3, 'platform', PLATFORMS)]:
+            with col:
+                st.subheader(CAPACITY_DIMS[dim])
+                for name in names: new_cap[dim][name] = st.number_input(name, min_value=0, step=1, value=int(limit_for(cap, dim, name if dim != 'platform' else ('', name))), key=f'cap_{dim}_{name}')
+        with k4:
+            st.subheader("廣告")
+            new_cap['ad']['*'] = st.number_input("同平台同日廣告篇數", min_value=0, step=1, value=int(cap['ad'].get('*', 0)), key='cap_ad')
+        if st.button("儲存上限", key='cap_save'):
+            save_capacity_limits(new_cap)
             st.success("已更新！")
 
     st.markdown("### 📊 成效分析設定")
@@ -858,55 +773,70 @@ with tab2:
     
     st.markdown("### 🏆 各平台成效")
     if target:
-        p_stats = []
-        for pf in PLATFORMS:
-            if pf == 'LINE@': continue # Skip LINE@ for now
-            
-            sub = [p for p in target if p['platform'] == pf]
-            if not sub: continue
-            
-            r = e = 0
-            for p in sub:
-                if is_metrics_disabled(p['platform'], p['postFormat']): continue
-                m = p.get(p_sel, {})
-                # Threads/YT included
-                r += safe_num(m.get('reach', 0))
-                e += (safe_num(m.get('likes', 0)) + safe_num(m.get('comments', 0)) + safe_num(m.get('shares', 0)))
-            
-            rt = (e/r*100) if r > 0 else 0
-            rt_s = f"{rt:.2f}%" if pf != 'Threads' else "-"
-            
-            p_stats.append({"平台": pf, "總觸及": int(r), "總互動": int(e), "互動率": rt_s, "篇數": len(sub)})
-        
-        # LINE@ Row (if exists in filter)
-        line_sub = [p for p in target if p['platform'] == 'LINE@']
-        if line_sub:
-             p_stats.append({"平台": "LINE@", "總觸及": "-", "總互動": "-", "互動率": "-", "篇數": len(line_sub)})
-
-        # Total Row
-        p_stats.append({
-            "平台": "📊 總計", 
-            "總觸及": "-", 
-            "總互動": "-", 
-            "互動率": "-",
-            "篇數": cnt
-        })
-        
-        df_stats = pd.DataFrame(p_stats)
-        st.dataframe(df_stats, use_container_width=True, hide_index=True)
+        st.dataframe(platform_stats(target, p_sel), use_container_width=True, hide_index=True)
+
+    # 🔥 跨品牌比較 (僅多品牌時顯示)
+    if multi_brand and target:
+        st.markdown("### 🏷️ 各品牌成效")
+        st.dataframe(brand_stats(target, brand_names, p_sel), use_container_width=True, hide_index=True)
+
+    # 🔥 活動彙總：多平台貼文合併成一個活動看總成效
+    campaigns = campaign_rollups(target, p_sel) if target else []
+    if campaigns:
+        st.markdown("### 🔗 活動彙總")
+        st.dataframe(campaigns, use_container_width=True, hide_index=True)
 
     st.markdown("### 🍰 類型分佈")
     view_type = st.radio("顯示模式", ["📄 表格模式", "📊 圖表模式"], horizontal=True)
     if target:
-        df = pd.DataFrame(target)
-        if not df.empty:
-            piv = pd.crosstab(df['platform'], df['postType'], margins=True, margins_name="總計")
-            ex_pf = [p for p in PLATFORMS if p in piv.index]
-            final_idx = ex_pf + ["總計"]
-            piv = piv.reindex(final_idx)
-
+        piv = type_crosstab(target)
+        if piv is not None:
             if view_type == "📄 表格模式":
                 st.dataframe(piv, use_container_width=True)
             else:
                 c_df = piv.drop(index="總計", columns="總計", errors='ignore')
                 st.bar_chart(c_df)
+
+    # 🔥 工作量熱圖：每週篇數，紅框 = 該週有某天超出每日上限
+    st.markdown("### 🗓️ 工作量熱圖")
+    h1, h2, h3 = st.columns([2, 1, 1])
+    heat_dim = h1.radio("對象", ['postOwner', 'designer', 'platform'], format_func=lambda d: CAPACITY_DIMS[d], horizontal=True, key='heat_dim')
+    heat_start = h2.date_input("起始週", value=datetime.now().date() - timedelta(days=datetime.now().weekday()), key='heat_start')
+    heat_weeks = h3.number_input("週數", min_value=1, max_value=26, value=8, step=1, key='heat_weeks')
+    heat_start = heat_start - timedelta(days=heat_start.weekday())
+    load = weekly_load(get_capacity_index(get_snapshot(), st.session_state.post_overlay), load_capacity_limits(), heat_dim, heat_start, int(heat_weeks))
+    if load:
+        import pandas as pd
+        week_cols = [(heat_start + timedelta(weeks=w)).strftime("%m/%d") for w in range(int(heat_weeks))]
+        names = [capacity_label(heat_dim, v) for v in load]
+        counts = pd.DataFrame([[n for n, _ in row] for row in load.values()], index=names, columns=week_cols)
+        over = pd.DataFrame([[o for _, o in row] for row in load.values()], index=names, columns=week_cols)
+        peak = max(int(counts.values.max()), 1)
+        def heat_css(df): return pd.DataFrame([[f"background-color: rgba(255, 75, 75, {0.08 + 0.6 * v / peak:.2f});" + (" border: 2px solid #d32f2f; font-weight: bold;" if o else "") for v, o in zip(r1, r2)] for r1, r2 in zip(counts.values, over.values)], index=df.index, columns=df.columns)
+        st.dataframe(counts.style.apply(heat_css, axis=None), use_container_width=True)
+    else:
+        st.caption("此區間沒有排程")
+
+    # 🔥 批次月報：所有 貼文負責人 × 美編 × 平台 組合，一次產生 HTML (zip)
+    with st.expander("📑 批次 KPI 月報"):
+        all_months = sorted({p['date'][:7] for p in posts if len(p.get('date', '')) >= 7}, reverse=True) or [datetime.now().strftime("%Y-%m")]
+        r1, r2 = st.columns(2)
+        rep_from = r1.selectbox("起始月份", all_months, index=min(11, len(all_months) - 1), key='report_from')
+        rep_to = r2.selectbox("結束月份", all_months, index=0, key='report_to')
+        st.caption("依側邊欄的品牌篩選；每個月份產生所有組合 (含「全部」) 的平台成效、類型分佈、KPI 分級與缺數據清單。")
+        job = st.session_state.get('report_job')
+        running = job is not None and not job['future'].done()
+        if st.button("🚀 背景產生月報", key='report_start', disabled=running or rep_from > rep_to):
+            months = month_range(rep_from, rep_to)
+            rep_posts = filter_posts(posts, brands=filter_brand)
+            job = st.session_state.report_job = {'months': months, 'future': get_report_executor().submit(build_report_zip, rep_posts, standards_book, months)}
+            running = True
+        if job:
+            if running:
+                st.info(f"⏳ 背景產生中 ({job['months'][0]} ~ {job['months'][-1]})…")
+                st.button("🔄 檢查進度", key='report_poll')
+            elif job['future'].exception() is not None: st.error(f"月報產生失敗: {job['future'].exception()}")
+            else:
+                st.download_button(f"📥 下載月報 ({job['months'][0]} ~ {job['months'][-1]})", job['future'].result(), f"kpi_reports_{job['months'][0]}_{job['months'][-1]}.zip", "application/zip", key='report_download', on_click='ignore')
+
+mark_startup('full')
@@ -0,0 +1,227 @@
+"""社群排程 CLI / 本機 HTTP API：不開 Streamlit 直接查詢貼文、KPI 與統計。
+
+    python schedule_cli.py posts --month 2025-06 --platform Facebook --format csv
+    python schedule_cli.py missing                     # 缺 7 天 / 30 天數據清單
+    python schedule_cli.py kpi --month 2025-06         # 各平台 KPI 分級篇數
+    python schedule_cli.py stats --by platform         # platform / brand / type / campaign
+    python schedule_cli.py report --from 2025-01 --to 2025-12 --out reports   # 批次 KPI 月報 (HTML)
+    python schedule_cli.py sync [--delta]              # 重新下載 Sheet (或只取變動的列) 並更新快取
+    python schedule_cli.py serve --port 8765           # GET /posts /missing /kpi /stats，POST /sync[?mode=delta]
+
+與 App 共用 schedule_core 的快照、磁碟快取 (.schedule_cache) 與 secrets.toml。
+資料載入失敗時查詢以非 0 結束 (HTTP 503)；部分品牌失敗時照常輸出其餘品牌，但結束碼為 1 (HTTP 207)。
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import schedule_core as core
+import schedule_report
+
+DEFAULT_MAX_AGE = 600   # 磁碟 / 記憶體快取可接受的秒數
+FILTER_ARGS = ['month', 'start', 'end', 'brand', 'platform', 'owner', 'type', 'purpose', 'format_', 'keyword']
+
+
+# --- 查詢 (CLI 與 HTTP 共用) ---
+def build_filters(params):
+    # params: {名稱: [值...]}；日期轉 date，其餘為清單
+    def one(k): return (params.get(k) or [None])[0]
+    def day(k): return datetime.strptime(one(k), "%Y-%m-%d").date() if one(k) else None
+    return {
+        'month': one('month'), 'start': day('start'), 'end': day('end'), 'keyword': one('keyword'),
+        'brands': params.get('brand'), 'platforms': params.get('platform'), 'owners': params.get('owner'),
+        'post_types': params.get('type'), 'purposes': params.get('purpose'), 'formats': params.get('format_'),
+    }
+
+class LoadFailed(Exception):
+    # 要查的品牌全部沒有資料 (未設定 Secrets / 認證失敗 / 下載失敗)
+    def __init__(self, errors):
+        super().__init__("無法載入資料"); self.errors = errors
+
+def load_posts(max_age=DEFAULT_MAX_AGE, brands=None):
+    # 回傳 (posts, {品牌: 錯誤})；行程內快取逾期時做差異同步 (serve 模式長時間執行)
+    # 部分品牌失敗時照常回傳其餘品牌 (由呼叫端回報錯誤)，全部沒有資料時拋出 LoadFailed，避免把「載入失敗」當成「沒有資料」
+    store = core.get_snapshot_store()
+    if store['loaded'] and time.time() - store['loaded_at'] > max_age: core.delta_refresh_brands(core.get_brands())
+    posts = list(core.get_snapshot(max_age=max_age)['posts'])
+    names = [b['name'] for b in core.get_brands() if not brands or b['name'] in brands]
+    errors = {name: store['errors'][name] for name in names if name in store['errors']}
+    if names and not any(name in store['brands'] for name in names): raise LoadFailed(errors or {name: "未載入" for name in names})
+    return posts, errors
+
+def run_query(command, params, max_age=DEFAULT_MAX_AGE):
+    # 回傳 (rows, {品牌: 錯誤})
+    posts, errors = load_posts(max_age, params.get('brand'))
+    return query_rows(command, core.filter_posts(posts, **build_filters(params)), params), errors
+
+def query_rows(command, posts, params):
+    period = (params.get('period') or ['metrics7d'])[0]
+    if command == 'posts': return [core.process_post_metrics(p) for p in posts]
+    if command == 'missing':
+        return [{k: pm.get(k) for k in ('id', 'brand', 'date', 'platform', 'topic', 'postOwner', 'bell7', 'bell30')} for pm in core.missing_metrics(posts)]
+    if command == 'kpi':
+        summary = core.kpi_summary(posts, core.get_standards_book(), period)
+        return [{'平台': pf, 'KPI': label, '篇數': n} for pf, counts in summary.items() for label, n in counts.items()]
+    if command == 'stats':
+        by = (params.get('by') or ['platform'])[0]
+        if by == 'brand': return core.brand_stats(posts, [b['name'] for b in core.get_brands()], period)
+        if by == 'campaign': return core.campaign_rollups(posts, period)
+        if by == 'type':
+            piv = core.type_crosstab(posts)
+            return [] if piv is None else [{'平台': idx, **{str(c): int(v) for c, v in row.items()}} for idx, row in piv.fillna(0).iterrows()]
+        return core.platform_stats(posts, period)
+    raise ValueError(f"未知的查詢: {command}")
+
+def render(command, rows, fmt):
+    if fmt == 'csv':
+        if command == 'posts': return core.encode_export(core.export_rows(rows), core.export_columns(), 'CSV').decode('utf-8-sig')
+        text = io.StringIO()
+        if rows:
+            writer = csv.DictWriter(text, fieldnames=list(rows[0].keys()))
+            writer.writeheader(); writer.writerows(rows)
+        return text.getvalue()
+    return json.dumps(rows, ensure_ascii=False, indent=2, default=str)
+
+
+# --- HTTP API ---
+class ApiHandler(BaseHTTPRequestHandler):
+    max_age = DEFAULT_MAX_AGE
+
+    def send_body(self, status, body, content_type, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        command = url.path.strip('/')
+        # 多選以逗號分隔：?platform=Facebook,Instagram
+        params = {k: [x for v in vs for x in v.split(',') if x] for k, vs in parse_qs(url.query).items()}
+        fmt = (params.pop('format', None) or ['json'])[0]
+        if command not in ('posts', 'missing', 'kpi', 'stats'):
+            return self.send_body(404, json.dumps({'error': 'not found'}), 'application/json')
+        try:
+            rows, errors = run_query(command, params, self.max_age)
+        except LoadFailed as e:
+            return self.send_body(503, json.dumps({'errors': e.errors}, ensure_ascii=False), 'application/json')
+        except ValueError as e:
+            return self.send_body(400, json.dumps({'error': str(e)}, ensure_ascii=False), 'application/json')
+        if not errors: return self.send_body(200, render(command, rows, fmt), 'text/csv' if fmt == 'csv' else 'application/json')
+        # 部分品牌失敗：207，JSON 包成 {data, errors}；CSV 的錯誤放在 X-Load-Errors 標頭
+        if fmt == 'csv': self.send_body(207, render(command, rows, fmt), 'text/csv', {'X-Load-Errors': json.dumps(errors)})
+        else: self.send_body(207, json.dumps({'data': rows, 'errors': errors}, ensure_ascii=False, indent=2, default=str), 'application/json')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.strip('/') != 'sync':
+            return self.send_body(404, json.dumps({'error': 'not found'}), 'application/json')
+        if parse_qs(url.query).get('mode') == ['delta']:
+            summary, errors = core.delta_refresh_brands(core.get_brands())
+            body = {'changed': {name: (None if res is None else {'changed': res[0], 'removed': res[1]}) for name, res in summary.items()}, 'errors': errors}
+        else: body = {'errors': core.refresh_brands(core.get_brands())}
+        self.send_body(200 if not body['errors'] else 207, json.dumps(body, ensure_ascii=False), 'application/json')
+
+def serve(host, port, max_age):
+    ApiHandler.max_age = max_age
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    print(f"🚀 HTTP API: http://{host}:{port}  (GET /posts /missing /kpi /stats, POST /sync)", file=sys.stderr)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="社群排程 CLI / HTTP API")
+    parser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE, help="可接受的快取秒數 (預設 600)")
+    parser.add_argument('--refresh', action='store_true', help="忽略快取，直接從 Google Sheet 載入")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in [('posts', "篩選後的貼文"), ('missing', "缺 7 天 / 30 天數據的貼文"), ('kpi', "KPI 分級篇數"), ('stats', "成效統計")]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--month', help="YYYY-MM")
+        p.add_argument('--start', help="YYYY-MM-DD")
+        p.add_argument('--end', help="YYYY-MM-DD")
+        p.add_argument('--brand', action='append')
+        p.add_argument('--platform', action='append')
+        p.add_argument('--owner', action='append')
+        p.add_argument('--type', action='append')
+        p.add_argument('--purpose', action='append')
+        p.add_argument('--post-format', dest='format_', action='append')
+        p.add_argument('--keyword')
+        p.add_argument('--period', choices=['metrics7d', 'metrics1m'], default='metrics7d')
+        p.add_argument('--format', choices=['json', 'csv'], default='json')
+        if name == 'stats': p.add_argument('--by', choices=['platform', 'brand', 'type', 'campaign'], default='platform')
+
+    p = sub.add_parser('report', help="批次產生 KPI 月報 (HTML)")
+    p.add_argument('--from', dest='from_month', required=True, help="YYYY-MM")
+    p.add_argument('--to', dest='to_month', help="YYYY-MM (預設同 --from)")
+    p.add_argument('--out', default='reports', help="輸出資料夾 (預設 reports)")
+    p.add_argument('--brand', action='append')
+    p.add_argument('--workers', type=int, help="子行程數 (預設 CPU 核心數)")
+
+    p = sub.add_parser('sync', help="重新下載所有品牌 Sheet 並更新快取")
+    p.add_argument('--delta', action='store_true', help="只取回雜湊變動的列 (手動改 Sheet 的列需完整同步)")
+    p = sub.add_parser('serve', help="啟動本機 HTTP API")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+
+    args = parser.parse_args(argv)
+    max_age = 0 if args.refresh else args.max_age
+
+    if args.command == 'sync':
+        if args.delta:
+            # 差異比對需要既有快照：先從磁碟快取載入
+            core.get_snapshot(max_age=max_age)
+            summary, errors = core.delta_refresh_brands(core.get_brands())
+            for name, res in summary.items(): print(f"{name}: " + ("完整下載" if res is None else f"{res[0]} 筆變動、{res[1]} 筆刪除"), file=sys.stderr)
+        else: errors = core.refresh_brands(core.get_brands())
+        for name, err in errors.items(): print(f"⚠️ {name}: {err}", file=sys.stderr)
+        return 1 if errors else 0
+    if args.command == 'report':
+        t0 = time.perf_counter()
+        try: months = schedule_report.month_range(args.from_month, args.to_month or args.from_month)
+        except ValueError:
+            print("❌ 月份格式應為 YYYY-MM", file=sys.stderr)
+            return 2
+        try: posts, errors = load_posts(max_age, args.brand)
+        except LoadFailed as e:
+            for name, err in e.errors.items(): print(f"❌ {name}: {err}", file=sys.stderr)
+            return 1
+        reports = schedule_report.generate_reports(core.filter_posts(posts, brands=args.brand), core.get_standards_book(), months, args.workers)
+        index = schedule_report.write_reports(reports, args.out)
+        print(f"✅ {len(reports) - 1} 份報表 ({months[0]} ~ {months[-1]})，{time.perf_counter() - t0:.1f} 秒 → {index}", file=sys.stderr)
+        # 部分品牌失敗：報表照常產生 (不含失敗的品牌)，但以非 0 結束
+        for name, err in errors.items(): print(f"⚠️ {name}: {err}", file=sys.stderr)
+        return 1 if errors else 0
+    if args.command == 'serve':
+        serve(args.host, args.port, max_age)
+        return 0
+
+    params = {k: ([v] if isinstance(v, str) else v) for k in FILTER_ARGS + ['period', 'by'] if (v := getattr(args, k, None))}
+    try:
+        rows, errors = run_query(args.command, params, max_age)
+    except LoadFailed as e:
+        for name, err in e.errors.items(): print(f"❌ {name}: {err}", file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    sys.stdout.write(render(args.command, rows, args.format))
+    if args.format == 'json': sys.stdout.write('\n')
+    # 部分品牌失敗：照常輸出其餘品牌，錯誤寫到 stderr 並以非 0 結束
+    for name, err in errors.items(): print(f"⚠️ {name}: {err}", file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
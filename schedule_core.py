@@ -0,0 +1,1230 @@
+"""社群排程核心：Google Sheet 存取、共享快照快取、KPI 判定與統計。
+
+不依賴 Streamlit，供 schedule.app.py (UI)、schedule_cli.py (CLI / HTTP API) 共用。
+"""
+import json
+import os
+import sys
+import time
+import uuid
+import math
+import io
+import csv
+import hashlib
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+# 🔥 pandas / gspread / oauth2client 在需要時才載入 (加快冷啟動)
+
+# --- 1. 配置與常數 ---
+# ⚠️ 請填入你的 Google Sheet 網址
+SHEET_URL = "https://docs.google.com/spreadsheets/d/1Nvqid5fHkcrkOJE322Xqv_R_7kU4krc9q8us3iswRGc/edit?gid=0#gid=0" 
+# 多品牌：在 secrets.toml 以 [[sheets]] name = "...", url = "..." 設定；未設定時只使用上面的 SHEET_URL
+DEFAULT_BRAND = "預設"
+LOAD_TIMEOUT = 20   # 單次同步等待秒數，逾時的品牌先顯示舊資料，完成後自動發布
+STANDARDS_FILE = "social_standards.json"
+TOKEN_CACHE_FILE = ".gsheet_token.json"   # Access Token 快取 (重啟後沿用，到期前自動失效)
+TOKEN_EXPIRY_MARGIN = 300                 # 到期前 5 分鐘即視為失效
+
+SNAPSHOT_CACHE_DIR = ".schedule_cache"   # 快照磁碟快取 (CLI / HTTP API 與 App 共用)
+
+# Google API Scope
+SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+# --- 核心設定：Google Sheet 中文欄位對照表 ---
+COL_MAP = {
+    'id': 'ID',
+    'date': '日期',
+    'platform': '平台',
+    'topic': '主題',
+    'postType': '類型',
+    'postSubType': '子類型',
+    'postPurpose': '目的',
+    'postFormat': '形式',
+    'projectOwner': '專案負責人',
+    'postOwner': '貼文負責人',
+    'designer': '美編',
+    'status': '狀態',
+    # 成效數據
+    'metrics7d_reach': '7天觸及',
+    'metrics7d_likes': '7天按讚',
+    'metrics7d_comments': '7天留言',
+    'metrics7d_shares': '7天分享',
+    'metrics7d_saves': '7天收藏',    # 🔥 新增欄位
+    'metrics7d_eng': '7天互動',
+    
+    'metrics1m_reach': '30天觸及',
+    'metrics1m_likes': '30天按讚',
+    'metrics1m_comments': '30天留言',
+    'metrics1m_shares': '30天分享',
+    'metrics1m_saves': '30天收藏',   # 🔥 新增欄位
+    'metrics1m_eng': '30天互動',
+    'campaignId': '活動ID',          # 🔥 多平台同時建立的貼文共用
+    'rowHash': '雜湊'                # 🔥 整列內容雜湊 (隱藏欄)，差異同步用；手動改 Sheet 不會更新
+}
+
+# 🔥 Sheet 欄位順序：觸及 -> 互動 -> 讚 -> 留言 -> 分享 -> 收藏
+SHEET_COLUMNS = [
+    'ID', '日期', '平台', '主題', '類型', '子類型', '目的', '形式', 
+    '專案負責人', '貼文負責人', '美編', '狀態',
+    '7天觸及', '7天互動', '7天按讚', '7天留言', '7天分享', '7天收藏', 
+    '30天觸及', '30天互動', '30天按讚', '30天留言', '30天分享', '30天收藏',
+    '活動ID', '雜湊'
+]
+SHEET_KEYS = [next(k for k, v in COL_MAP.items() if v == c) for c in SHEET_COLUMNS]
+HASH_COLUMN = '雜湊'
+DATA_COLUMNS = [c for c in SHEET_COLUMNS if c != HASH_COLUMN]   # 匯出 / 計算雜湊用的內容欄位
+DATA_KEYS = [k for k in SHEET_KEYS if k != 'rowHash']
+DELTA_MAX_RATIO = 0.5   # 變動列超過一半時直接完整下載比較快
+CHANGE_LOG_SIZE = 20
+
+# 匯出設定 (格式: 副檔名, MIME)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'XLSX': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+EXPORT_CHUNK_ROWS = 2000   # 分塊編碼，每塊列數
+EXPORT_REQUIRES = {'Parquet': 'pyarrow', 'XLSX': 'openpyxl'}
+EXPORT_DIR = os.path.join(SNAPSHOT_CACHE_DIR, 'exports')   # 背景匯出檔放磁碟，不留在 session 記憶體
+EXPORT_KEEP_SECONDS = 86400   # 超過一天的匯出檔在下次匯出時清除
+# 完整歷史匯出額外附上的計算欄位
+EXPORT_EXTRA_COLS = ['品牌', '星期', '7天互動率(%)', '30天互動率(%)', 'KPI(7天)', 'KPI(30天)', '缺7天數據', '缺30天數據']
+
+# 選項定義
+PLATFORMS = ['Facebook', 'Instagram', 'LINE@', 'YouTube', 'Threads', '社團']
+MAIN_POST_TYPES = ['喜餅', '彌月', '伴手禮', '社群互動', '圓夢計畫', '公告']
+SOUVENIR_SUB_TYPES = ['端午節', '中秋', '聖誕', '新春', '蒙友週']
+POST_PURPOSES = ['互動', '廣告', '門市廣告', '導購', '公告']
+POST_FORMATS = ['單圖', '多圖', '假多圖', '短影音', '限動', '純文字', '留言處']
+
+# 選項 (含空白)
+PROJECT_OWNERS = ['', '夢涵', 'MOMO', '櫻樺', '季嫻', '凌萱', '宜婷', '門市']
+POST_OWNERS = ['一千', '楷曜', '可榆']
+DESIGNERS = ['', '千惟', '靖嬙']
+
+# 週期系列
+WEEKDAY_NAMES = ["週一", "週二", "週三", "週四", "週五", "週六", "週日"]
+RRULE_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+SERIES_MAX_DATES = 120   # 單次系列最多日期數，避免誤設範圍一次產生過多貼文
+
+
+# --- 外部掛勾：UI 層可替換錯誤顯示與啟動計時 (預設印到 stderr / 不計時) ---
+HOOKS = {'error': lambda msg: print(msg, file=sys.stderr), 'mark': lambda stage: None}
+
+def report_error(msg): HOOKS['error'](msg)
+
+# --- Secrets：Streamlit 執行時由 App 注入 st.secrets，CLI 直接讀同一份 secrets.toml ---
+SECRETS_FILES = [os.path.join('.streamlit', 'secrets.toml'), os.path.expanduser(os.path.join('~', '.streamlit', 'secrets.toml'))]
+_secrets = None
+
+def use_secrets(secrets):
+    global _secrets
+    _secrets = secrets
+
+def get_secrets():
+    global _secrets
+    if _secrets is None:
+        import tomllib
+        _secrets = {}
+        for path in SECRETS_FILES:
+            if os.path.exists(path):
+                with open(path, 'rb') as f: _secrets = tomllib.load(f)
+                break
+    return _secrets
+
+# --- 2. Google Sheets 連線與資料處理 ---
+
+def load_cached_token(account):
+    try:
+        with open(TOKEN_CACHE_FILE, 'r', encoding='utf-8') as f: tok = json.load(f)
+        if tok.get('account') == account and tok.get('expires_at', 0) - TOKEN_EXPIRY_MARGIN > time.time():
+            return tok.get('access_token')
+    except: pass
+    return None
+
+def save_cached_token(account, access_token, expires_in):
+    tmp = TOKEN_CACHE_FILE + '.tmp'
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'account': account, 'access_token': access_token, 'expires_at': time.time() + expires_in}, f)
+        os.replace(tmp, TOKEN_CACHE_FILE)
+    except OSError: pass
+
+def get_client():
+    try:
+        secrets = get_secrets()
+        if "service_account" in secrets:
+            import gspread
+            creds_dict = dict(secrets["service_account"])
+            account = creds_dict.get('client_email', '')
+            token = load_cached_token(account)
+            if token:
+                # 🔥 有效的快取 Token：不必重新簽署 JWT，也不載入 oauth2client
+                from google.oauth2.credentials import Credentials
+                return gspread.authorize(Credentials(token))
+            from oauth2client.service_account import ServiceAccountCredentials
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+            try:
+                info = creds.get_access_token()
+                save_cached_token(account, info.access_token, info.expires_in)
+            except Exception: pass
+            return gspread.authorize(creds)
+        else:
+            report_error("❌ 未設定 Secrets")
+            return None
+    except Exception as e:
+        report_error(f"認證失敗: {e}")
+        return None
+
+def safe_num(val):
+    try:
+        if isinstance(val, str): val = val.replace(',', '').strip()
+        f = float(val)
+        if math.isnan(f) or math.isinf(f): return 0.0
+        return f
+    except: return 0.0
+
+def normalize_date(raw):
+    if not raw: return raw
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S'):
+        try: return datetime.strptime(raw, fmt).strftime('%Y-%m-%d')
+        except ValueError: pass
+    # 少見格式才交給 pandas 解析
+    import pandas as pd
+    try: return pd.to_datetime(raw).strftime('%Y-%m-%d')
+    except: return raw
+
+def get_brands():
+    try:
+        secrets = get_secrets()
+        if "sheets" in secrets:
+            return [{'name': str(b['name']), 'url': str(b['url'])} for b in secrets["sheets"]]
+    except Exception: pass
+    return [{'name': DEFAULT_BRAND, 'url': SHEET_URL}]
+
+def get_brand(name):
+    return next((b for b in get_brands() if b['name'] == name), None)
+
+def parse_records(raw_records, brand_name, kept=None):
+    # kept: 傳入 list 時記下每篇對應的 raw_records 索引 (補寫 ID / 雜湊用)
+    processed_posts = []; blank_seen = {}
+    for ri, row in enumerate(raw_records):
+        def get_val(cn_key, default=""):
+            return row.get(cn_key, default)
+
+        r_topic = str(get_val('主題', '')).strip()
+        r_date = str(get_val('日期', '')).strip()
+        if not r_topic and not r_date: continue
+
+        raw_id = str(get_val('ID')).strip()
+        final_id = raw_id
+
+        std_date = normalize_date(r_date)
+
+        v_likes_7 = safe_num(get_val('7天按讚', ''))
+        if v_likes_7 == 0: v_likes_7 = safe_num(get_val('7天互動', 0))
+        
+        v_likes_30 = safe_num(get_val('30天按讚', ''))
+        if v_likes_30 == 0: v_likes_30 = safe_num(get_val('30天互動', 0))
+
+        m7 = {
+            'reach': safe_num(get_val('7天觸及', 0)),
+            'likes': v_likes_7,
+            'comments': safe_num(get_val('7天留言', 0)),
+            'shares': safe_num(get_val('7天分享', 0)),
+            'saves': safe_num(get_val('7天收藏', 0)) # 🔥 讀取收藏
+        }
+        m1 = {
+            'reach': safe_num(get_val('30天觸及', 0)),
+            'likes': v_likes_30,
+            'comments': safe_num(get_val('30天留言', 0)),
+            'shares': safe_num(get_val('30天分享', 0)),
+            'saves': safe_num(get_val('30天收藏', 0)) # 🔥 讀取收藏
+        }
+        
+        post = {
+            'id': final_id,
+            'date': std_date,
+            'platform': str(get_val('平台', 'Facebook')),
+            'topic': r_topic,
+            'postType': str(get_val('類型', '')),
+            'postSubType': str(get_val('子類型', '')),
+            'postPurpose': str(get_val('目的', '')),
+            'postFormat': str(get_val('形式', '')),
+            'projectOwner': str(get_val('專案負責人', '')),
+            'postOwner': str(get_val('貼文負責人', '')),
+            'designer': str(get_val('美編', '')),
+            'status': str(get_val('狀態', 'published')),
+            'metrics7d': m7,
+            'metrics1m': m1,
+            'campaignId': str(get_val('活動ID', '')).strip(),
+            'rowHash': str(get_val(HASH_COLUMN, '')).strip(),
+            'brand': brand_name
+        }
+        if not raw_id:
+            # 沒有 ID 的列 (手動新增)：以內容雜湊當 ID，每次載入 / 差異同步都相同；內容相同的列依出現順序編號
+            key = to_sheet_row(flatten_post(post))[-1]; n = blank_seen[key] = blank_seen.get(key, 0) + 1
+            post['id'] = f"row-{key}" + (f"-{n}" if n > 1 else "")
+        processed_posts.append(post)
+        if kept is not None: kept.append(ri)
+    return processed_posts
+
+def fetch_brand_posts(client, brand):
+    # 於背景執行緒執行：不可碰 UI，錯誤直接拋出
+    sheet = client.open_by_url(brand['url']).sheet1
+    records = sheet.get_all_records(); kept = []
+    posts = parse_records(records, brand['name'], kept)
+    # 標題是目前版本 (舊版則先往後補齊) 時，順便補寫缺少的 ID 與缺少 / 過期的雜湊
+    header = list(records[0].keys()) if records else []
+    try: aligned = bool(header) and (header == SHEET_COLUMNS or (header == SHEET_COLUMNS[:len(header)] and ensure_header(sheet)))
+    except Exception: aligned = False
+    if aligned: backfill_row_keys(sheet, [(ri + 2, p, str(records[ri].get('ID', '')).strip(), str(records[ri].get(HASH_COLUMN, '')).strip()) for p, ri in zip(posts, kept)])
+    return posts
+
+def cell_runs(col, cells):
+    # [(列號, 值)] → 連續列合併成 batch_update 的範圍
+    runs = []
+    for r, v in cells:
+        if runs and runs[-1][-1][0] == r - 1: runs[-1].append((r, v))
+        else: runs.append([(r, v)])
+    return [{'range': f"{col}{run[0][0]}:{col}{run[-1][0]}", 'values': [[v] for _, v in run]} for run in runs]
+
+def backfill_row_keys(sheet, items):
+    # 🔥 舊版 / 手動新增或修改的列沒有 ID 或正確雜湊，差異同步每次都得重抓；讀到時順手補寫
+    # items: [(列號, post, Sheet 上的 ID, Sheet 上的雜湊)]；寫入成功才把雜湊記到 post 上 (post 尚未發布，可直接修改)
+    todo = [(r, p, raw_id, raw, h) for r, p, raw_id, raw in items if (h := to_sheet_row(flatten_post(p))[-1]) != raw or not raw_id]
+    if not todo: return
+    # 寫入前重讀這些列：讀取之後有人插入 / 刪除列時列號已對不上，ID 與內容都沒變的列才補寫，其餘留到下次讀取
+    last = column_letter(len(SHEET_COLUMNS)); runs = []
+    for r, *_ in todo:
+        if runs and runs[-1][1] == r - 1: runs[-1][1] = r
+        else: runs.append([r, r])
+    try: blocks = sheet.batch_get([f"A{a}:{last}{b}" for a, b in runs])
+    except Exception: return
+    now = {}
+    for (a, b), block in zip(runs, blocks):
+        for j in range(b - a + 1):
+            row = list(block[j]) if j < len(block) else []
+            now[a + j] = dict(zip(SHEET_COLUMNS, row + [""] * (len(SHEET_COLUMNS) - len(row))))
+    rows = list(now); kept = []
+    current = {rows[ri]: q for q, ri in zip(parse_records(list(now.values()), '', kept), kept)}
+    todo = [t for t in todo if t[0] in current and str(now[t[0]].get('ID', '')).strip() == t[2] and to_sheet_row(flatten_post({**current[t[0]], 'id': t[1]['id']}))[-1] == t[4]]
+    hashes = [(r, p, h) for r, p, _, raw, h in todo if h != raw]
+    data = cell_runs('A', [(r, p['id']) for r, p, raw_id, _, _ in todo if not raw_id]) + cell_runs(last, [(r, h) for r, _, h in hashes])
+    if not data: return
+    try: sheet.batch_update(data)
+    except Exception: return   # 沒有寫入權限等：維持原樣，下次再補
+    for _, p, h in hashes: p['rowHash'] = h
+
+def delta_fetch_brand(client, brand, snapshot):
+    # 🔥 差異同步：先抓 ID、日期、主題、雜湊 四欄，只用 batch_get 取回雜湊不同 (或沒有雜湊 / ID) 的列
+    # 回傳 (posts, 舊貼文, 新貼文, 只換雜湊的篇數)；標題不符或變動太多時回傳 None，由呼叫端改做完整下載
+    sheet = client.open_by_url(brand['url']).sheet1
+    last = column_letter(len(SHEET_COLUMNS))
+    date_col, topic_col = (column_letter(SHEET_COLUMNS.index(c) + 1) for c in ('日期', '主題'))
+    # API 會省略範圍尾端的空白格：列數以四欄中最長的為準 (底部沒有 ID 的手動新增列也要看到)
+    header, *cols = sheet.batch_get([f"A1:{last}1", "A2:A", f"{date_col}2:{date_col}", f"{topic_col}2:{topic_col}", f"{last}2:{last}"])
+    if not header or list(header[0]) != SHEET_COLUMNS: return None
+    n = max(len(c) for c in cols)
+    ids, dates, topics, hashes = ([str(c[i][0]).strip() if i < len(c) and c[i] else "" for i in range(n)] for c in cols)
+    known = {p['id']: p for p in snapshot['posts']}
+    posts = [None] * n; stale = []
+    for i, (pid, h) in enumerate(zip(ids, hashes)):
+        old = known.get(pid)
+        if not dates[i] and not topics[i]: continue   # 空白列 (parse_records 也會略過)
+        if old is not None and h and old.get('rowHash') == h: posts[i] = old
+        else: stale.append(i)
+    if len(stale) > max(n * DELTA_MAX_RATIO, 50): return None
+    # 連續的列合併成一個範圍，一次 batch_get 取回
+    runs = []
+    for i in stale:
+        if runs and runs[-1][1] == i - 1: runs[-1][1] = i
+        else: runs.append([i, i])
+    blocks = sheet.batch_get([f"A{a + 2}:{last}{b + 2}" for a, b in runs]) if runs else []
+    rows, where = [], []
+    for (a, b), block in zip(runs, blocks):
+        for j in range(b - a + 1):
+            row = list(block[j]) if j < len(block) else []
+            rows.append(dict(zip(SHEET_COLUMNS, row + [""] * (len(SHEET_COLUMNS) - len(row))))); where.append(a + j)
+    # 一次解析 (依列順序)，沒有 ID 的列編號才會與完整下載一致
+    parsed_at = []
+    fetched = [(where[ri], p) for p, ri in zip(parse_records(rows, brand['name'], parsed_at), parsed_at)]
+    backfill_row_keys(sheet, [(i + 2, p, ids[i], hashes[i]) for i, p in fetched])
+    refreshed = {}   # 新物件 id → 舊物件：內容沒變，只換上 Sheet 的雜湊，不算變動
+    for i, new in fetched:
+        old = known.get(new['id'])
+        if old is not None and flatten_post(old) == flatten_post(new):
+            if old.get('rowHash') == new['rowHash']: new = old
+            else: new = {**old, 'rowHash': new['rowHash']}; refreshed[id(new)] = old
+        posts[i] = new
+    posts = [p for p in posts if p is not None]
+    kept = {id(p) for p in posts} | {id(p) for p in refreshed.values()}; before = {id(p) for p in snapshot['posts']}
+    return posts, [p for p in snapshot['posts'] if id(p) not in kept], [p for p in posts if id(p) not in before and id(p) not in refreshed], len(refreshed)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(name, max_workers):
+    # 行程共用的執行緒池 (Sheet 下載 / 背景匯出 / 月報)
+    with _pools_lock:
+        if name not in _pools: _pools[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _pools[name]
+
+def get_loader_pool(): return get_pool('sheet-load', 8)
+
+def get_export_executor(): return get_pool('export', 1)
+
+def get_report_executor(): return get_pool('report', 1)   # 月報另用一條，不與完整歷史匯出互相排隊
+
+def load_data(brands):
+    # 🔥 所有品牌 Sheet 並行下載，總耗時約等於最慢的一個；回傳 ({品牌: posts}, {品牌: 錯誤}, {品牌: 下載前的快照版本})
+    store = STORE
+    versions = {b['name']: get_brand_snapshot(b['name'])['version'] for b in brands}
+    client = get_client()
+    HOOKS['mark']('auth')
+    if not client: return {}, {b['name']: "認證失敗" for b in brands}, versions
+    futures = {get_loader_pool().submit(fetch_brand_posts, client, b): b['name'] for b in brands}
+    done, pending = wait(futures, timeout=LOAD_TIMEOUT)
+    HOOKS['mark']('fetch')
+    results, errors = {}, {}
+    for f in done:
+        try: results[futures[f]] = f.result()
+        except Exception as e: errors[futures[f]] = str(e)
+    # 逾時錯誤要在掛上完成回呼之前寫入，否則回呼先發布、清掉錯誤後又被補回去
+    with store['lock']:
+        for f in pending:
+            name = futures[f]; errors[name] = "逾時，稍後自動更新"
+            if get_brand_snapshot(name)['version'] == versions[name]: store['errors'][name] = errors[name]
+    for f in pending:
+        # 慢的 Sheet 完成後直接發布 (執行緒內不碰 session)；期間已有較新的快照則丟棄
+        f.add_done_callback(lambda fut, name=futures[f]: fut.exception() is None and publish_if_current(name, fut.result(), versions[name], store))
+    return results, errors, versions
+
+def flatten_post(p):
+    m7 = p.get('metrics7d', {}) or {}
+    m1 = p.get('metrics1m', {}) or {}
+    
+    # 🔥 自動計算互動總數 (讚+留言+分享+收藏)
+    eng7 = safe_num(m7.get('likes', 0)) + safe_num(m7.get('comments', 0)) + safe_num(m7.get('shares', 0)) + safe_num(m7.get('saves', 0))
+    eng30 = safe_num(m1.get('likes', 0)) + safe_num(m1.get('comments', 0)) + safe_num(m1.get('shares', 0)) + safe_num(m1.get('saves', 0))
+
+    return {
+        'id': str(p.get('id')).strip(),
+        'date': p.get('date'),
+        'platform': p.get('platform'),
+        'topic': p.get('topic'),
+        'postType': p.get('postType'),
+        'postSubType': p.get('postSubType'),
+        'postPurpose': p.get('postPurpose'),
+        'postFormat': p.get('postFormat'),
+        'projectOwner': p.get('projectOwner'),
+        'postOwner': p.get('postOwner'),
+        'designer': p.get('designer'),
+        'status': p.get('status', 'published'),
+        
+        'metrics7d_reach': m7.get('reach', 0), 
+        'metrics7d_likes': m7.get('likes', 0),
+        'metrics7d_comments': m7.get('comments', 0), 
+        'metrics7d_shares': m7.get('shares', 0),
+        'metrics7d_saves': m7.get('saves', 0), # 🔥 寫入收藏
+        'metrics7d_eng': eng7,
+        
+        'metrics1m_reach': m1.get('reach', 0), 
+        'metrics1m_likes': m1.get('likes', 0),
+        'metrics1m_comments': m1.get('comments', 0), 
+        'metrics1m_shares': m1.get('shares', 0),
+        'metrics1m_saves': m1.get('saves', 0), # 🔥 寫入收藏
+        'metrics1m_eng': eng30,
+        'campaignId': p.get('campaignId', '')
+    }
+
+def row_hash(values):
+    # 整數值的 float 與 int 視為相同 (App 寫入 1000、讀回解析成 1000.0 時雜湊不變)
+    return hashlib.sha1(json.dumps([str(int(v)) if isinstance(v, float) and v.is_integer() else str(v) for v in values], ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+def to_sheet_row(flat):
+    values = [("" if flat.get(k) is None else flat.get(k)) for k in DATA_KEYS]
+    return values + [row_hash(values)]
+
+def hashed_rows(posts):
+    # 寫入 Sheet 的列，以及帶上新雜湊的貼文 (雜湊不同才換成新物件，快照中的舊物件不就地修改)
+    rows, out = [], []
+    for p in posts:
+        row = to_sheet_row(flatten_post(p)); rows.append(row)
+        out.append(p if p.get('rowHash') == row[-1] else {**p, 'rowHash': row[-1]})
+    return rows, out
+
+def hide_hash_column(sheet):
+    # 雜湊欄對使用者沒意義，盡量隱藏 (權限不足等失敗時忽略)
+    try: sheet.hide_columns(len(SHEET_COLUMNS) - 1, len(SHEET_COLUMNS))
+    except Exception: pass
+
+def save_data(data, brand_name):
+    # 成功時回傳寫入的貼文 (帶新雜湊，供發布快照)，失敗回傳 False
+    client = get_client()
+    if not client: return False
+    try:
+        sheet = client.open_by_url(get_brand(brand_name)['url']).sheet1
+        rows, saved = hashed_rows([p for p in data if p.get('topic') or p.get('date')])
+
+        if rows:
+            sheet.clear()
+            try: sheet.resize(rows=len(rows)+2, cols=len(SHEET_COLUMNS)) 
+            except: pass
+            sheet.update([SHEET_COLUMNS] + rows)
+            hide_hash_column(sheet)
+        else:
+            sheet.clear()
+            sheet.append_row(SHEET_COLUMNS)
+        return saved
+
+    except Exception as e:
+        report_error(f"儲存失敗: {e}")
+        return False
+
+def ensure_header(sheet):
+    # 欄位只往後加：舊版 Sheet 的標題若是目前欄位的前段，補上新標題即可；順序不同則回傳 False (需整表重寫)
+    header = sheet.row_values(1)
+    if header == SHEET_COLUMNS: return True
+    if not header or header != SHEET_COLUMNS[:len(header)]: return False
+    # 🔥 舊表的格線只有舊欄數，要先加寬才寫得進新標題；加寬 / 寫入失敗也回傳 False，讓呼叫端改走整表重寫
+    try:
+        if sheet.col_count < len(SHEET_COLUMNS): sheet.resize(cols=len(SHEET_COLUMNS))
+        sheet.update([SHEET_COLUMNS], 'A1')
+    except Exception: return False
+    hide_hash_column(sheet)
+    return True
+
+def append_data(new_posts, brand_name):
+    # 成功時回傳帶新雜湊的貼文；標題不符時回傳 None，由呼叫端改走整表寫入
+    client = get_client()
+    if not client: return False
+    try:
+        sheet = client.open_by_url(get_brand(brand_name)['url']).sheet1
+        if not ensure_header(sheet): return None
+        rows, saved = hashed_rows(new_posts)
+        if rows: sheet.append_rows(rows)
+        return saved
+    except Exception as e:
+        report_error(f"新增失敗: {e}")
+        return False
+
+def column_letter(n):
+    out = ""
+    while n: n, r = divmod(n - 1, 26); out = chr(65 + r) + out
+    return out
+
+def update_rows(posts, brand_name):
+    # 🔥 只改寫這幾篇所在的列，一次 batch_update 送出；先讀 ID 欄對照列號 (其他人可能插入/刪除過列)
+    # 成功時回傳帶新雜湊的貼文；標題列無法對齊或找不到 ID 時回傳 None，由呼叫端改走整表寫入
+    client = get_client()
+    if not client: return False
+    try:
+        sheet = client.open_by_url(get_brand(brand_name)['url']).sheet1
+        if not ensure_header(sheet): return None
+        row_of = {str(v).strip(): i + 1 for i, v in enumerate(sheet.col_values(1))}
+        if any(str(p['id']).strip() not in row_of for p in posts): return None
+        last_col = column_letter(len(SHEET_COLUMNS))
+        rows, saved = hashed_rows(posts)
+        sheet.batch_update([{'range': f"A{row_of[str(p['id']).strip()]}:{last_col}{row_of[str(p['id']).strip()]}", 'values': [row]} for p, row in zip(posts, rows)])
+        return saved
+    except Exception as e:
+        report_error(f"儲存失敗: {e}")
+        return False
+
+# --- 週期系列 (類 RRULE：FREQ=WEEKLY;INTERVAL;BYDAY;UNTIL + EXDATE) ---
+def expand_series(start, until, weekdays, interval=1, skip=()):
+    week0 = start - timedelta(days=start.weekday())
+    dates = []; d = start
+    while d <= until:
+        if d.weekday() in weekdays and ((d - week0).days // 7) % interval == 0 and d not in skip: dates.append(d)
+        d += timedelta(days=1)
+    return dates
+
+def series_rrule_text(until, weekdays, interval):
+    days = ",".join(RRULE_DAYS[i] for i in sorted(weekdays))
+    return f"FREQ=WEEKLY;INTERVAL={interval};BYDAY={days};UNTIL={until.strftime('%Y%m%d')}"
+
+def parse_date_list(text):
+    dates = set(); bad = []
+    for tok in text.replace('，', ',').replace('\n', ',').split(','):
+        tok = tok.strip()
+        if not tok: continue
+        try: dates.add(datetime.strptime(normalize_date(tok), "%Y-%m-%d").date())
+        except: bad.append(tok)
+    return dates, bad
+
+# --- 共享快照 (Copy-on-Write) ---
+# 同一行程內所有 session / 請求共用同一份唯讀快照 (每個品牌各一份，tuple 不可就地修改)；
+# 修改先放在呼叫端的 overlay {id: post 或 None(刪除)}，儲存成功後發布該品牌的新版本快照。
+# 發布時一併寫入磁碟快取，讓 CLI 不必重新下載整張 Sheet。
+
+STORE = {'lock': threading.RLock(), 'loaded': False, 'loaded_at': 0.0, 'version': 0, 'brands': {}, 'errors': {}, 'combined': None, 'changes': [], 'index_patch': None}
+
+def get_snapshot_store(): return STORE
+
+def make_snapshot(posts, version):
+    posts = tuple(posts)
+    return {'version': version, 'posts': posts, 'ids': frozenset(p['id'] for p in posts)}
+
+def snapshot_cache_path(brand):
+    return os.path.join(SNAPSHOT_CACHE_DIR, hashlib.sha1(brand['url'].encode('utf-8')).hexdigest()[:16] + '.json')
+
+def write_snapshot_cache(brand_name, posts):
+    brand = get_brand(brand_name)
+    if not brand: return
+    path = snapshot_cache_path(brand); tmp = path + '.tmp'
+    try:
+        os.makedirs(SNAPSHOT_CACHE_DIR, exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump({'brand': brand_name, 'saved_at': time.time(), 'posts': list(posts)}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError: pass
+
+def read_snapshot_cache(brand, max_age):
+    try:
+        with open(snapshot_cache_path(brand), 'r', encoding='utf-8') as f: data = json.load(f)
+        if time.time() - data.get('saved_at', 0) <= max_age: return data['posts']
+    except: pass
+    return None
+
+def publish_snapshot(brand_name, posts, store=None, persist=True):
+    store = store or STORE
+    with store['lock']:
+        prev = store['brands'].get(brand_name)
+        store['brands'][brand_name] = make_snapshot(posts, prev['version'] + 1 if prev else 1)
+        store['errors'].pop(brand_name, None)
+        store['version'] += 1
+        if persist: write_snapshot_cache(brand_name, store['brands'][brand_name]['posts'])
+        return store['brands'][brand_name]
+
+def publish_if_current(brand_name, posts, version, store=None):
+    # 只在快照仍是讀取時那一版才發布：讀取期間其他 session 已寫入 / 已發布較新的內容時丟棄這份結果
+    store = store or STORE
+    with store['lock']:
+        if get_brand_snapshot(brand_name)['version'] != version: return None
+        return publish_snapshot(brand_name, posts, store)
+
+def refresh_brands(brands):
+    results, errors, versions = load_data(brands)
+    with STORE['lock']:
+        for name, brand_posts in results.items(): publish_if_current(name, brand_posts, versions[name])
+        # 載入期間版本已變 (慢 Sheet 的回呼或其他 session 已發布) 的品牌不再標為錯誤
+        STORE['errors'].update({name: err for name, err in errors.items() if get_brand_snapshot(name)['version'] == versions[name]})
+        # 全部失敗時不標記已載入，下一次會再試
+        if results: STORE['loaded'] = True; STORE['loaded_at'] = time.time()
+    return errors
+
+def delta_refresh_brands(brands):
+    # 🔥 差異同步：成本約等於變動列數；沒有快照或無法差異同步的品牌退回完整下載
+    # 回傳 ({品牌: (變動, 刪除) 或 None (完整下載)}, {品牌: 錯誤})
+    client = get_client()
+    if not client: return {}, {b['name']: "認證失敗" for b in brands}
+    snaps = {b['name']: get_brand_snapshot(b['name']) for b in brands if b['name'] in STORE['brands']}
+    futures = {get_loader_pool().submit(delta_fetch_brand, client, b, snaps[b['name']]): b for b in brands if b['name'] in snaps}
+    full = [b for b in brands if b['name'] not in STORE['brands']]
+    done, pending = wait(futures, timeout=LOAD_TIMEOUT)
+    summary, errors, results = {}, {}, {}
+    for f in done:
+        try: results[futures[f]['name']] = f.result()
+        except Exception as e: errors[futures[f]['name']] = str(e)
+    for f in pending: errors[futures[f]['name']] = "逾時"
+    with STORE['lock']:
+        v0 = STORE['version']; removed_all, added_all = [], []
+        for name, res in results.items():
+            if res is None: full.append(get_brand(name)); continue
+            # 差異同步成功 = 快照已與 Sheet 一致，清掉先前輪詢 / 載入留下的錯誤 (否則品牌一直不能寫入)
+            STORE['errors'].pop(name, None)
+            # 比對期間其他 session 已寫入 / 發布新版：這份差異以舊快照為底，發布會蓋掉剛寫入的修改，留給下一次同步
+            if get_brand_snapshot(name)['version'] != snaps[name]['version']: continue
+            posts, removed, added, refreshed = res
+            STORE['loaded_at'] = time.time()
+            if not removed and not added:
+                # 只有雜湊更新：照樣發布 (下次不再重抓)，但不算變動、不通知
+                summary[name] = (0, 0)
+                if refreshed: publish_snapshot(name, posts)
+                continue
+            publish_snapshot(name, posts)
+            removed_all += removed; added_all += added
+            n_removed = len({p['id'] for p in removed} - {p['id'] for p in added})
+            summary[name] = (len(added), n_removed)
+            STORE['changes'] = (STORE['changes'] + [{'version': STORE['version'], 'brand': name, 'changed': len(added), 'removed': n_removed, 'at': time.time()}])[-CHANGE_LOG_SIZE:]
+        # 合併快照重建時，依這份差異修補工作量索引，不必整份重建
+        if STORE['version'] != v0: STORE['index_patch'] = (v0, STORE['version'], removed_all, added_all)
+    if full:
+        errors.update(refresh_brands(full))
+        for b in full:
+            if b['name'] not in errors: summary[b['name']] = None
+    return summary, errors
+
+POLLER = {'thread': None, 'interval': 0}
+
+def start_delta_poller(interval):
+    # 背景每 interval 秒做一次差異同步 (同一行程只啟動一個)；各 session 以 STORE['changes'] 顯示通知
+    with STORE['lock']:
+        if POLLER['thread'] is not None and POLLER['thread'].is_alive(): return
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    _, errors = delta_refresh_brands(get_brands())
+                    with STORE['lock']: STORE['errors'].update(errors)
+                except Exception as e: print(f"[delta-poller] {e}", file=sys.stderr)
+        POLLER['thread'] = threading.Thread(target=loop, name='delta-poller', daemon=True); POLLER['interval'] = interval
+        POLLER['thread'].start()
+
+def changes_since(version):
+    return [c for c in STORE['changes'] if c['version'] > version]
+
+def get_brand_snapshot(brand_name):
+    return STORE['brands'].get(brand_name) or make_snapshot([], 0)
+
+def brand_writable(brand_name):
+    # 載入失敗 / 逾時的品牌快照是空的或舊的，以它為底寫入會覆蓋掉 Sheet 上的資料
+    return brand_name in STORE['brands'] and brand_name not in STORE['errors']
+
+def get_snapshot(max_age=None):
+    # 跨品牌合併快照：依設定順序串接，任一品牌發布新版本時才重建
+    # max_age (秒)：允許先用磁碟快取 (CLI 用)；None 表示一律從 Sheet 載入
+    if not STORE['loaded']:
+        with STORE['lock']:
+            if not STORE['loaded']:
+                missing = get_brands()
+                if max_age is not None:
+                    for b in missing:
+                        cached = read_snapshot_cache(b, max_age)
+                        if cached is not None: publish_snapshot(b['name'], cached, persist=False)
+                    missing = [b for b in missing if b['name'] not in STORE['brands']]
+                    if not missing: STORE['loaded'] = True; STORE['loaded_at'] = time.time()
+                if missing: refresh_brands(missing)
+                HOOKS['mark']('parse')
+    combined = STORE['combined']
+    if combined is None or combined['version'] != STORE['version']:
+        with STORE['lock']:
+            prev = STORE['combined']; patch = STORE['index_patch']
+            posts = [p for b in get_brands() for p in get_brand_snapshot(b['name'])['posts']]
+            STORE['combined'] = combined = make_snapshot(posts, STORE['version'])
+            if prev is not None and prev.get('capacity') is not None and patch and patch[0] == prev['version'] and patch[1] == combined['version']:
+                combined['capacity'] = patch_capacity_index(prev['capacity'], patch[2], patch[3])
+    return combined
+
+def merge_overlay(snapshot, overlay):
+    if not overlay: return list(snapshot['posts'])
+    merged = [overlay.get(p['id'], p) for p in snapshot['posts']]
+    merged += [p for pid, p in overlay.items() if pid not in snapshot['ids']]
+    return [p for p in merged if p is not None]
+
+def brand_overlay(brand_name, snapshot, overlay):
+    # 只取屬於該品牌的修改：既有貼文看快照 id，新貼文看 post['brand']
+    return {pid: p for pid, p in overlay.items() if pid in snapshot['ids'] or (p is not None and p.get('brand') == brand_name)}
+
+def commit_changes(overlay, force_brands=()):
+    # 以「最新」快照為底合併 overlay，避免覆蓋其他 session 已儲存的內容；只重寫有變動的品牌
+    # 成功寫入的項目會從 overlay 移除，失敗的留著等下次重試
+    ok = True
+    with STORE['lock']:
+        for b in get_brands():
+            snap = get_brand_snapshot(b['name'])
+            sub = brand_overlay(b['name'], snap, overlay)
+            if not sub and b['name'] not in force_brands: continue
+            if not brand_writable(b['name']):
+                report_error(f"⚠️ {b['name']} 尚未成功載入，暫不寫入 (請先同步)"); ok = False; continue
+            merged = merge_overlay(snap, sub)
+            # 只有修改既有貼文時逐列更新，有新增 / 刪除 (列位移) 時才整表重寫
+            # 發布的快照用寫入時算好的雜湊，差異同步才不會把剛寫入的列當成變動
+            written = None
+            if sub and b['name'] not in force_brands and all(p is not None and pid in snap['ids'] for pid, p in sub.items()):
+                written = update_rows(list(sub.values()), b['name'])
+                if written: merged = merge_overlay(snap, {p['id']: p for p in written})
+            if written is None:
+                written = save_data(merged, b['name'])
+                if written is not False: merged = written
+            if written is not False:
+                publish_snapshot(b['name'], merged)
+                for pid in sub: overlay.pop(pid, None)
+            else: ok = False
+    return ok
+
+def append_posts(new_posts, overlay):
+    # 🔥 新增貼文只 append 新列，不重寫整張 Sheet
+    brand_name = new_posts[0]['brand']
+    with STORE['lock']:
+        if not brand_writable(brand_name):
+            report_error(f"⚠️ {brand_name} 尚未成功載入，暫不寫入 (請先同步)")
+            for p in new_posts: overlay[p['id']] = p
+            return False
+        snap = get_brand_snapshot(brand_name)
+        if brand_overlay(brand_name, snap, overlay) or not snap['posts']:
+            # 有未儲存修改或 Sheet 確實為空 (可能沒有標題列) 時，退回整表寫入
+            for p in new_posts: overlay[p['id']] = p
+            return commit_changes(overlay)
+        appended = append_data(new_posts, brand_name)
+        if not appended:
+            for p in new_posts: overlay[p['id']] = p
+            return commit_changes(overlay) if appended is None else False
+        publish_snapshot(brand_name, list(snap['posts']) + appended)
+    return True
+
+def clear_brand(brand_name, overlay):
+    with STORE['lock']:
+        if not brand_writable(brand_name):
+            report_error(f"⚠️ {brand_name} 尚未成功載入，暫不寫入 (請先同步)"); return False
+        old = get_brand_snapshot(brand_name)
+        if save_data([], brand_name) is False: return False
+        publish_snapshot(brand_name, [])
+    for pid in brand_overlay(brand_name, old, overlay): overlay.pop(pid, None)
+    return True
+
+# KPI 標準 (依生效日期分版本)
+# social_standards.json: {"versions": [{"effective": "YYYY-MM-DD", "standards": {...}}, ...]}
+# 每篇貼文以「發文日當時生效」的版本判定，調整目標不會改寫歷史成績。
+# 每個版本只編譯一次成門檻表 (各級 觸及/互動/互動率 預先算好)；檔案 mtime 變動時自動重新載入。
+STANDARDS_EPOCH = "2000-01-01"   # 舊格式 (單一設定) 視為自此日起生效
+STANDARD_SCHEMES = {'Facebook': 'tiered', 'Instagram': 'simple', 'YouTube': 'simple', '社團': 'simple', 'Threads': 'reference'}
+FB_TIERS = [('high', '🏆 高標', 'purple', 2000, 100), ('std', '✅ 標準', 'green', 1500, 45), ('low', '🤏 低標', 'orange', 1000, 15)]
+STANDARDS_CACHE = {'lock': threading.Lock(), 'book': None}
+
+def default_standards():
+    return {'Facebook': {'type': 'tiered', 'high': {'reach': 2000, 'engagement': 100}, 'std': {'reach': 1500, 'engagement': 45}, 'low': {'reach': 1000, 'engagement': 15}},'Instagram': {'type': 'simple', 'reach': 900, 'engagement': 30},'Threads': {'type': 'reference', 'reach': 500, 'reach_label': '瀏覽', 'engagement': 50, 'engagement_label': '互動', 'rate': 0},'YouTube': {'type': 'simple', 'reach': 500, 'engagement': 20},'LINE@': {'type': 'simple', 'reach': 0, 'engagement': 0},'社團': {'type': 'simple', 'reach': 500, 'engagement': 20}}
+
+def read_standard_versions():
+    try:
+        with open(STANDARDS_FILE, 'r', encoding='utf-8') as f: data = json.load(f)
+    except: data = None
+    if not data: return [{'effective': STANDARDS_EPOCH, 'standards': default_standards()}]
+    if 'versions' not in data: return [{'effective': STANDARDS_EPOCH, 'standards': data}]
+    return sorted(data['versions'], key=lambda v: v['effective'])
+
+def target_rate(reach, eng): return (eng / reach * 100) if reach > 0 else 0
+
+def compile_standards(standards):
+    # {平台: 門檻表}；None 表示未設定標準
+    table = {}
+    for pf, std in standards.items():
+        scheme = STANDARD_SCHEMES.get(pf) if std else None
+        if not std: table[pf] = None
+        elif scheme == 'tiered':
+            tiers = []; lines = []
+            for key, name, color, dr, de in FB_TIERS:
+                t = std.get(key, {'reach': dr, 'engagement': de}); r = t.get('reach', dr); e = t.get('engagement', de); rt = target_rate(r, e)
+                tiers.append((name, color, r, e, rt))
+                lines.append(f"{name.split(' ')[-1]}: 觸及{int(r)} / 互動{int(e)} (率{rt:.1f}%)")
+            table[pf] = {'scheme': scheme, 'tiers': tiers, 'tooltip': "\n".join(lines)}
+        elif scheme == 'simple':
+            r = std.get('reach', 0); e = std.get('engagement', 0); rt = target_rate(r, e)
+            table[pf] = {'scheme': scheme, 'target': (r, e, rt), 'tooltip': f"目標: 觸及 {int(r)} / 互動 {int(e)} (率{rt:.1f}%)"}
+        elif scheme == 'reference':
+            r = std.get('reach', 500); e = std.get('engagement', 50); l_reach = std.get('reach_label', '瀏覽'); l_eng = std.get('engagement_label', '互動')
+            table[pf] = {'scheme': scheme, 'target': (r, e), 'labels': (l_reach, l_eng), 'tooltip': f"{l_reach}: {int(r)} / {l_eng}: {int(e)}"}
+        else: table[pf] = {'scheme': None, 'tooltip': ""}
+    return table
+
+def get_standards_book():
+    # 行程共用的版本簿：{'mtime', 'starts': [生效日], 'versions', 'tables': [門檻表]}，不可變、整份替換
+    try: info = os.stat(STANDARDS_FILE); mtime = (info.st_mtime_ns, info.st_size)
+    except OSError: mtime = None
+    book = STANDARDS_CACHE['book']
+    if book is None or book['mtime'] != mtime:
+        with STANDARDS_CACHE['lock']:
+            book = STANDARDS_CACHE['book']
+            if book is None or book['mtime'] != mtime:
+                versions = read_standard_versions()
+                book = STANDARDS_CACHE['book'] = {'mtime': mtime, 'starts': [v['effective'] for v in versions], 'versions': versions, 'tables': [compile_standards(v['standards']) for v in versions]}
+    return book
+
+def version_index(book, on=None):
+    # 區間查找：最後一個 生效日 <= on 的版本；早於第一版的貼文用第一版
+    return max(bisect_right(book['starts'], str(on or datetime.now().date())[:10]) - 1, 0)
+
+def load_standards(on=None):
+    # 回傳 on (預設今天) 生效版本的可編輯複本
+    book = get_standards_book()
+    return json.loads(json.dumps(book['versions'][version_index(book, on)]['standards']))
+
+def write_json_atomic(path, data):
+    # tmp + os.replace：其他行程不會讀到寫一半的檔案
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp, path)
+
+def save_standards(standards, effective=None):
+    # 新增 / 取代同一生效日的版本
+    effective = str(effective or datetime.now().date())[:10]
+    with STANDARDS_CACHE['lock']:
+        versions = [v for v in read_standard_versions() if v['effective'] != effective] + [{'effective': effective, 'standards': standards}]
+        versions.sort(key=lambda v: v['effective'])
+        write_json_atomic(STANDARDS_FILE, {'versions': versions})
+        STANDARDS_CACHE['book'] = None
+    return get_standards_book()
+
+def resolve_standards(standards, on=None):
+    # 版本簿 → 依日期挑門檻表；單一設定 dict (舊呼叫方式) → 當場編譯
+    if standards is None: standards = get_standards_book()
+    if 'tables' in standards: return standards['tables'][version_index(standards, on)]
+    return compile_standards(standards)
+
+def is_metrics_disabled(platform, fmt): return platform == 'LINE@' or fmt in ['限動', '留言處']
+
+def get_performance_label(platform, metrics, fmt, standards=None, on=None):
+    if is_metrics_disabled(platform, fmt): return "🚫 不計", "gray", "此形式/平台不需計算成效"
+    reach = safe_num(metrics.get('reach', 0))
+    if reach == 0: return "-", "gray", "尚未填寫數據"
+    
+    # 🔥 互動計算包含收藏
+    eng = safe_num(metrics.get('likes', 0)) + safe_num(metrics.get('comments', 0)) + safe_num(metrics.get('shares', 0)) + safe_num(metrics.get('saves', 0))
+    
+    rate = (eng / reach) * 100
+    table = resolve_standards(standards, on).get(platform)
+    if not table: return "-", "gray", "未設定標準"
+    scheme = table['scheme']; tooltip = table['tooltip']
+    if scheme == 'tiered':
+        for name, color, t_reach, t_eng, t_rate in table['tiers']:
+            if (reach >= t_reach) or (eng >= t_eng) or (rate >= t_rate):
+                return name + ("雙指標" if (reach >= t_reach and eng >= t_eng) else ("觸及" if reach >= t_reach else "互動")), color, tooltip
+        return "🔴 未達標", "red", tooltip
+    elif scheme == 'simple':
+        t_reach, t_eng, t_rate = table['target']
+        if (reach >= t_reach) or (eng >= t_eng) or (rate >= t_rate): return "✅ 達標", "green", tooltip
+        else: return "🔴 未達標", "red", tooltip
+    elif scheme == 'reference':
+        (t_reach, t_eng), (l_reach, l_eng) = table['target'], table['labels']
+        pass_reach = reach >= t_reach; pass_eng = eng >= t_eng
+        if pass_reach and pass_eng: return "✅ 雙指標", "green", tooltip
+        elif pass_reach: return f"✅ {l_reach}", "green", tooltip
+        elif pass_eng: return f"✅ {l_eng}", "green", tooltip
+        else: return "🔴 未達標", "red", tooltip
+    return "-", "gray", tooltip
+
+def process_post_metrics(p):
+    m7 = p.get('metrics7d', {}); m30 = p.get('metrics1m', {})
+    
+    # 🔥 互動計算包含收藏
+    r7 = safe_num(m7.get('reach', 0)); e7 = safe_num(m7.get('likes', 0)) + safe_num(m7.get('comments', 0)) + safe_num(m7.get('shares', 0)) + safe_num(m7.get('saves', 0))
+    r30 = safe_num(m30.get('reach', 0)); e30 = safe_num(m30.get('likes', 0)) + safe_num(m30.get('comments', 0)) + safe_num(m30.get('shares', 0)) + safe_num(m30.get('saves', 0))
+    
+    rate7_val = (e7 / r7 * 100) if r7 > 0 else 0; rate30_val = (e30 / r30 * 100) if r30 > 0 else 0
+    disabled = is_metrics_disabled(p.get('platform'), p.get('postFormat')); is_threads = p.get('platform') == 'Threads'
+    rate7_str = "-"; rate30_str = "-"
+    if disabled or is_threads: rate7_str = "🚫 不計"; rate30_str = "🚫 不計"
+    elif r7 > 0: rate7_str = f"{rate7_val:.1f}%"; rate30_str = f"{rate30_val:.1f}%" if r30 > 0 else "-"
+    today = datetime.now().date()
+    try: p_date = datetime.strptime(p.get('date', ''), "%Y-%m-%d").date()
+    except: p_date = today
+    
+    weekdays_tw = ["(一)", "(二)", "(三)", "(四)", "(五)", "(六)", "(日)"]
+    wd = weekdays_tw[p_date.weekday()]
+    date_display = f"{p.get('date', '')} {wd}"
+
+    # 🔥 警示邏輯: 7天=🔔, 30天=⏰
+    bell7 = False; bell30 = False
+    if not disabled: 
+        if today >= (p_date + timedelta(days=7)) and r7 == 0: bell7 = True
+        if today >= (p_date + timedelta(days=30)) and r30 == 0: bell30 = True
+    return {**p, 'r7': int(r7), 'e7': int(e7), 'rate7_val': rate7_val, 'rate7_str': rate7_str, 'bell7': bell7, 'r30': int(r30), 'e30': int(e30), 'rate30_val': rate30_val, 'rate30_str': rate30_str, 'bell30': bell30, '_sort_date': p.get('date', str(today)), 'date_display': date_display}
+
+# --- 工作量 / 撞期 (日期 × 貼文負責人 / 美編 / 平台 索引) ---
+CAPACITY_FILE = "social_capacity.json"
+CAPACITY_DIMS = {'postOwner': '貼文負責人', 'designer': '美編', 'platform': '平台', 'ad': '廣告'}
+CAPACITY_CACHE = {'lock': threading.Lock(), 'mtime': None, 'limits': None}
+
+def default_capacity_limits():
+    # 每日上限；'*' 為預設，其餘為個別人員 / 平台；0 表示不限
+    return {'postOwner': {'*': 4}, 'designer': {'*': 3}, 'platform': {'*': 3}, 'ad': {'*': 1}}
+
+def load_capacity_limits():
+    try: info = os.stat(CAPACITY_FILE); mtime = (info.st_mtime_ns, info.st_size)
+    except OSError: mtime = None
+    with CAPACITY_CACHE['lock']:
+        if CAPACITY_CACHE['limits'] is None or CAPACITY_CACHE['mtime'] != mtime:
+            limits = default_capacity_limits()
+            try:
+                with open(CAPACITY_FILE, 'r', encoding='utf-8') as f:
+                    for dim, values in json.load(f).items(): limits.setdefault(dim, {}).update(values)
+            except: pass
+            CAPACITY_CACHE['limits'] = limits; CAPACITY_CACHE['mtime'] = mtime
+        return CAPACITY_CACHE['limits']
+
+def save_capacity_limits(limits):
+    write_json_atomic(CAPACITY_FILE, limits)
+    with CAPACITY_CACHE['lock']: CAPACITY_CACHE['limits'] = None
+    return load_capacity_limits()
+
+def capacity_keys(p):
+    # 一篇貼文佔用的 (維度, 值)；平台與廣告以 (品牌, 平台) 區分不同品牌的帳號
+    keys = [(dim, p.get(dim)) for dim in ('postOwner', 'designer') if p.get(dim)]
+    account = (p.get('brand', DEFAULT_BRAND), p.get('platform', ''))
+    keys.append(('platform', account))
+    if '廣告' in (p.get('postPurpose') or ''): keys.append(('ad', account))
+    return keys
+
+def build_capacity_index(posts):
+    # {(維度, 值): {日期: [id, ...]}}：單日負載 O(1)、一週 O(7)，與貼文總數無關
+    idx = {}
+    for p in posts:
+        for key in capacity_keys(p): idx.setdefault(key, {}).setdefault(p.get('date', ''), []).append(p['id'])
+    return idx
+
+def patch_capacity_index(idx, removed, added):
+    # 差異同步用：只複製受影響的 (維度, 值) 再增減 id，舊快照的索引維持不變
+    new = dict(idx); copied = set()
+    def bucket(key):
+        if key not in copied: new[key] = dict(new.get(key, {})); copied.add(key)
+        return new[key]
+    for p in removed:
+        for key in capacity_keys(p):
+            b = bucket(key); d = p.get('date', '')
+            b[d] = [pid for pid in b.get(d, ()) if pid != p['id']]
+            if not b[d]: del b[d]
+    for p in added:
+        for key in capacity_keys(p):
+            b = bucket(key); d = p.get('date', '')
+            b[d] = b.get(d, []) + [p['id']]
+    return new
+
+def get_capacity_index(snapshot, overlay=None):
+    # 快照不可變，索引跟著快照版本快取；有未儲存的修改時才以合併後資料重建
+    if overlay: return build_capacity_index(merge_overlay(snapshot, overlay))
+    idx = snapshot.get('capacity')
+    if idx is None: idx = snapshot['capacity'] = build_capacity_index(snapshot['posts'])
+    return idx
+
+def capacity_label(dim, value):
+    if dim in ('platform', 'ad'): return value[1] if value[0] == DEFAULT_BRAND else f"{value[0]} · {value[1]}"
+    return value
+
+def limit_for(limits, dim, value):
+    name = value[1] if dim in ('platform', 'ad') else value
+    return limits.get(dim, {}).get(name, limits.get(dim, {}).get('*', 0))
+
+def check_capacity(idx, limits, drafts, exclude_ids=()):
+    # drafts: 編輯中的貼文 (可多日期 × 多平台)；回傳超出上限的 [(日期, 維度, 值, 篇數, 上限)]
+    extra = {}
+    for d in drafts:
+        for key in capacity_keys(d): extra[(key, d['date'])] = extra.get((key, d['date']), 0) + 1
+    conflicts = []
+    for ((dim, value), date), n_new in extra.items():
+        limit = limit_for(limits, dim, value)
+        if not limit: continue
+        n = sum(1 for pid in idx.get((dim, value), {}).get(date, ()) if pid not in exclude_ids) + n_new
+        if n > limit: conflicts.append((date, dim, value, n, limit))
+    return sorted(conflicts, key=lambda c: (c[0], list(CAPACITY_DIMS).index(c[1])))
+
+def suggest_slots(idx, limits, drafts, start, count=3, horizon=30, exclude_ids=()):
+    # 由近而遠 (同距離先看之後) 找出所有草稿都不超過上限的日期；不建議今天以前
+    today = datetime.now().date(); slots = []
+    if isinstance(start, datetime): start = start.date()
+    for off in range(1, horizon + 1):
+        for d in (start + timedelta(days=off), start - timedelta(days=off)):
+            if d < today or len(slots) >= count: continue
+            ds = d.strftime("%Y-%m-%d")
+            if not check_capacity(idx, limits, [{**x, 'date': ds} for x in drafts], exclude_ids): slots.append(d)
+        if len(slots) >= count: break
+    return sorted(slots)
+
+def weekly_load(idx, limits, dim, start, weeks):
+    # {值: [(該週篇數, 超出每日上限的天數), ...]}；start 為第一週的星期一
+    days = [[(start + timedelta(days=w * 7 + i)).strftime("%Y-%m-%d") for i in range(7)] for w in range(weeks)]
+    load = {}
+    for (d, value), by_date in idx.items():
+        if d != dim: continue
+        limit = limit_for(limits, dim, value); row = []
+        for week in days:
+            counts = [len(by_date.get(ds, ())) for ds in week]
+            row.append((sum(counts), sum(1 for n in counts if limit and n > limit)))
+        if any(n for n, _ in row): load[value] = row
+    return load
+
+# --- 篩選與統計 (App 側邊欄 / 數據分析頁、CLI、HTTP API 共用) ---
+def filter_posts(posts, month=None, start=None, end=None, brands=None, platforms=None, owners=None, post_types=None, purposes=None, formats=None, keyword=None):
+    out = posts
+    if month: out = [p for p in out if p.get('date', '').startswith(month)]
+    if start or end:
+        def in_range(p):
+            try: d = datetime.strptime(p.get('date', ''), "%Y-%m-%d").date()
+            except ValueError: return False
+            return (not start or start <= d) and (not end or d <= end)
+        out = [p for p in out if in_range(p)]
+    if brands: out = [p for p in out if p.get('brand') in brands]
+    if platforms: out = [p for p in out if p['platform'] in platforms]
+    if owners: out = [p for p in out if p['postOwner'] in owners]
+    if keyword: out = [p for p in out if keyword.lower() in p['topic'].lower()]
+    if post_types: out = [p for p in out if p['postType'] in post_types]
+    if purposes: out = [p for p in out if p['postPurpose'] in purposes]
+    if formats: out = [p for p in out if p['postFormat'] in formats]
+    return out
+
+def sum_reach_eng(posts, period, saves=False):
+    # saves=True 時互動含收藏 (與 process_post_metrics 的單篇互動一致)
+    r = e = 0
+    for p in posts:
+        if is_metrics_disabled(p['platform'], p['postFormat']): continue
+        m = p.get(period, {})
+        r += safe_num(m.get('reach', 0))
+        e += (safe_num(m.get('likes', 0)) + safe_num(m.get('comments', 0)) + safe_num(m.get('shares', 0)) + (safe_num(m.get('saves', 0)) if saves else 0))
+    return r, e
+
+def platform_stats(posts, period='metrics7d'):
+    totals = {}
+    for pf in PLATFORMS:
+        sub = [p for p in posts if p['platform'] == pf]
+        if sub: totals[pf] = (*sum_reach_eng(sub, period), len(sub))
+    return platform_stats_from_totals(totals, len(posts))
+
+def platform_stats_from_totals(totals, total_count):
+    # totals: {平台: (觸及, 互動, 篇數)}；批次報表直接用預先彙總的數字組表
+    p_stats = []
+    for pf in PLATFORMS:
+        if pf == 'LINE@': continue # Skip LINE@ for now
+        if pf not in totals: continue
+        
+        # Threads/YT included
+        r, e, n = totals[pf]
+        rt = (e/r*100) if r > 0 else 0
+        rt_s = f"{rt:.2f}%" if pf != 'Threads' else "-"
+        
+        p_stats.append({"平台": pf, "總觸及": int(r), "總互動": int(e), "互動率": rt_s, "篇數": n})
+    
+    # LINE@ Row (if exists in filter)
+    if 'LINE@' in totals:
+         p_stats.append({"平台": "LINE@", "總觸及": "-", "總互動": "-", "互動率": "-", "篇數": totals['LINE@'][2]})
+
+    # Total Row
+    p_stats.append({"平台": "📊 總計", "總觸及": "-", "總互動": "-", "互動率": "-", "篇數": total_count})
+    return p_stats
+
+def brand_stats(posts, brand_names, period='metrics7d'):
+    b_stats = []
+    for bn in brand_names:
+        sub = [p for p in posts if p.get('brand') == bn]
+        if not sub: continue
+        r, e = sum_reach_eng(sub, period)
+        b_stats.append({"品牌": bn, "總觸及": int(r), "總互動": int(e), "互動率": f"{(e/r*100) if r > 0 else 0:.2f}%", "篇數": len(sub)})
+    return b_stats
+
+def campaign_rollups(posts, period='metrics7d'):
+    # 依活動ID彙總跨平台成效；最佳平台 = 互動數最高 (同分看觸及)，互動含收藏才不會低估 IG
+    groups = {}
+    for p in posts:
+        if p.get('campaignId'): groups.setdefault(p['campaignId'], []).append(p)
+    rows = []
+    for cid, sub in groups.items():
+        r, e = sum_reach_eng(sub, period, saves=True)
+        best = max(sub, key=lambda p: sum_reach_eng([p], period, saves=True)[::-1])
+        best_r, best_e = sum_reach_eng([best], period, saves=True)
+        rows.append({"活動ID": cid, "日期": min(p['date'] for p in sub), "主題": sub[0]['topic'], "平台": "、".join(p['platform'] for p in sub),
+                     "總觸及": int(r), "總互動": int(e), "互動率": f"{(e/r*100) if r > 0 else 0:.2f}%", "最佳平台": best['platform'] if best_r or best_e else "-"})
+    return sorted(rows, key=lambda x: x["日期"], reverse=True)
+
+CAMPAIGN_SHARED_FIELDS = ['date', 'topic', 'postType', 'postSubType', 'projectOwner', 'postOwner', 'designer']   # 活動層級的修改一起套用 (目的 / 形式 / 成效各平台不同)
+
+def campaign_siblings(posts, post):
+    # 同一活動的其他平台貼文
+    cid = post.get('campaignId')
+    if not cid: return []
+    return [p for p in posts if p.get('campaignId') == cid and p['id'] != post['id']]
+
+def type_crosstab(posts):
+    import pandas as pd
+    df = pd.DataFrame(posts)
+    if df.empty: return None
+    piv = pd.crosstab(df['platform'], df['postType'], margins=True, margins_name="總計")
+    ex_pf = [p for p in PLATFORMS if p in piv.index]
+    return piv.reindex(ex_pf + ["總計"])
+
+def missing_metrics(posts):
+    # 缺 7 天 (🔔) / 30 天 (⏰) 數據的貼文
+    return [pm for pm in (process_post_metrics(p) for p in posts) if pm['bell7'] or pm['bell30']]
+
+def kpi_summary(posts, standards=None, period='metrics7d'):
+    # {平台: {KPI 標籤: 篇數}}；每篇依發文日的標準版本判定
+    summary = {}
+    for p in posts:
+        label = get_performance_label(p['platform'], p.get(period, {}) or {}, p['postFormat'], standards, p.get('date'))[0]
+        counts = summary.setdefault(p['platform'], {})
+        counts[label] = counts.get(label, 0) + 1
+    return summary
+
+# --- 匯出 (按需產生，分塊編碼) ---
+def export_columns(full=False):
+    return DATA_COLUMNS + (EXPORT_EXTRA_COLS if full else [])
+
+def export_rows(posts, full=False, standards=None):
+    # 逐列產生，不一次建立整張 DataFrame；計數欄轉為整數
+    for p in posts:
+        flat = flatten_post(p)
+        row = [(int(safe_num(flat[k])) if k.startswith('metrics') else ("" if flat.get(k) is None else str(flat[k]))) for k in DATA_KEYS]
+        if full:
+            pm = process_post_metrics(p)
+            kpi7 = get_performance_label(p.get('platform'), p.get('metrics7d', {}) or {}, p.get('postFormat'), standards, p.get('date'))[0]
+            kpi30 = get_performance_label(p.get('platform'), p.get('metrics1m', {}) or {}, p.get('postFormat'), standards, p.get('date'))[0]
+            row += [p.get('brand', ''), pm['date_display'].split(' ')[-1], round(pm['rate7_val'], 2), round(pm['rate30_val'], 2), kpi7, kpi30, "🔔" if pm['bell7'] else "", "⏰" if pm['bell30'] else ""]
+        yield row
+
+def iter_chunks(rows, size):
+    chunk = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= size: yield chunk; chunk = []
+    if chunk: yield chunk
+
+def encode_export(rows, columns, fmt, out=None):
+    # 逐塊編碼；out 為檔案時直接寫入並回傳 None，否則回傳 bytes
+    buf = io.BytesIO() if out is None else out
+    if fmt == 'CSV':
+        text = io.StringIO(); csv.writer(text).writerow(columns)
+        buf.write(text.getvalue().encode('utf-8-sig'))
+        for chunk in iter_chunks(rows, EXPORT_CHUNK_ROWS):
+            text = io.StringIO(); csv.writer(text).writerows(chunk)
+            buf.write(text.getvalue().encode('utf-8'))
+    elif fmt == 'Parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        num_cols = {COL_MAP[k] for k in DATA_KEYS if k.startswith('metrics')}
+        rate_cols = {'7天互動率(%)', '30天互動率(%)'}
+        schema = pa.schema([(c, pa.int64() if c in num_cols else (pa.float64() if c in rate_cols else pa.string())) for c in columns])
+        with pq.ParquetWriter(buf, schema) as writer:
+            for chunk in iter_chunks(rows, EXPORT_CHUNK_ROWS):
+                writer.write_table(pa.Table.from_pylist([dict(zip(columns, r)) for r in chunk], schema=schema))
+    elif fmt == 'XLSX':
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True); ws = wb.create_sheet('posts'); ws.append(columns)
+        for chunk in iter_chunks(rows, EXPORT_CHUNK_ROWS):
+            for r in chunk: ws.append(r)
+        wb.save(buf)
+    return buf.getvalue() if out is None else None
+
+def export_filename(prefix, fmt):
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d')}.{EXPORT_FORMATS[fmt][0]}"
+
+def export_available(fmt):
+    import importlib.util
+    return fmt not in EXPORT_REQUIRES or importlib.util.find_spec(EXPORT_REQUIRES[fmt]) is not None
+
+def new_export_path(fmt):
+    # 順便清掉過期的舊匯出檔
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    for name in os.listdir(EXPORT_DIR):
+        full = os.path.join(EXPORT_DIR, name)
+        try:
+            if time.time() - os.path.getmtime(full) > EXPORT_KEEP_SECONDS: os.remove(full)
+        except OSError: pass
+    return os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex}.{EXPORT_FORMATS[fmt][0]}")
+
+def remove_export(path):
+    try: os.remove(path)
+    except OSError: pass
+
+def read_export(path):
+    with open(path, 'rb') as f: return f.read()
+
+def build_history_export(posts, fmt, standards, path):
+    # 在背景執行緒執行：不可碰 UI；寫入 path 後回傳路徑 (下載時才讀檔)
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as f: encode_export(export_rows(posts, full=True, standards=standards), export_columns(full=True), fmt, f)
+        os.replace(tmp, path)
+    except BaseException:
+        remove_export(tmp); raise
+    return path
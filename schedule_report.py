@@ -0,0 +1,160 @@
+"""每月 KPI 報表批次產生：一次產出所有「貼文負責人 × 美編 × 平台」組合的 HTML 報表。
+
+父行程先把貼文彙總成 (月份, 負責人, 美編, 平台) 的小格子 (觸及/互動、類型、KPI 分級、缺數據清單)，
+每篇只判定一次 KPI；子行程 (ProcessPool) 依月份分工，把格子合併成各組合的報表。
+"""
+import html
+import io
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+
+import schedule_core as core
+
+ALL = '全部'
+PERIODS = [('metrics7d', '7天'), ('metrics1m', '30天')]
+REPORT_CSS = """
+body { font-family: 'Noto Sans TC', 'Microsoft JhengHei', sans-serif; margin: 24px; color: #333; }
+h1 { font-size: 1.4em; } h2 { font-size: 1.1em; margin-top: 28px; border-left: 4px solid #1877F2; padding-left: 8px; }
+table { border-collapse: collapse; margin: 8px 0; font-size: 0.9em; }
+th, td { border: 1px solid #ddd; padding: 4px 10px; text-align: right; } th { background: #f5f5f5; }
+td:first-child, th:first-child { text-align: left; }
+.meta { color: #666; font-size: 0.85em; } .empty { color: #999; }
+"""
+
+def month_range(start, end):
+    # 'YYYY-MM' ~ 'YYYY-MM' (含頭尾)
+    y, m = map(int, start.split('-')); ey, em = map(int, end.split('-'))
+    months = []
+    while (y, m) <= (ey, em):
+        months.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+# --- 父行程：預先彙總 ---
+def new_cell():
+    return {'n': 0, 'totals': {p: [0, 0] for p, _ in PERIODS}, 'types': {}, 'kpi': {p: {} for p, _ in PERIODS}, 'missing': []}
+
+def build_cells(posts, standards, months):
+    # {月份: {(貼文負責人, 美編, 平台): 格子}}
+    cells = {m: {} for m in months}
+    for p in posts:
+        month = p.get('date', '')[:7]
+        if month not in cells: continue
+        key = (p.get('postOwner', ''), p.get('designer', ''), p.get('platform', ''))
+        cell = cells[month].get(key) or cells[month].setdefault(key, new_cell())
+        cell['n'] += 1
+        cell['types'][p.get('postType', '')] = cell['types'].get(p.get('postType', ''), 0) + 1
+        for period, _ in PERIODS:
+            r, e = core.sum_reach_eng([p], period)
+            cell['totals'][period][0] += r; cell['totals'][period][1] += e
+            label = core.get_performance_label(p.get('platform'), p.get(period, {}) or {}, p.get('postFormat'), standards, p.get('date'))[0]
+            cell['kpi'][period][label] = cell['kpi'][period].get(label, 0) + 1
+        pm = core.process_post_metrics(p)
+        if pm['bell7'] or pm['bell30']:
+            cell['missing'].append((pm['date_display'], p.get('platform', ''), p.get('topic', ''), p.get('postOwner', ''), p.get('designer', ''), "🔔" if pm['bell7'] else "", "⏰" if pm['bell30'] else ""))
+    return cells
+
+# --- 子行程：合併格子並產生 HTML ---
+def html_table(columns, rows):
+    if not rows: return '<p class="empty">（無資料）</p>'
+    head = ''.join(f'<th>{html.escape(str(c))}</th>' for c in columns)
+    body = ''.join('<tr>' + ''.join(f'<td>{html.escape(str(v))}</td>' for v in r) + '</tr>' for r in rows)
+    return f'<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>'
+
+def display_name(v): return v if v else '(未填)'
+
+def slug(v): return re.sub(r'[\\/:*?"<>|\s]+', '_', display_name(v))
+
+def render_report(month, combo, group):
+    # group: [(key, cell)]，key 的平台欄決定各平台表格的列
+    owner, designer, platform = combo
+    n = sum(c['n'] for _, c in group)
+    title = f"{month} KPI 月報｜貼文負責人: {display_name(owner)}｜美編: {display_name(designer)}｜平台: {display_name(platform)}"
+    pfs = [pf for pf in core.PLATFORMS if any(k[2] == pf for k, _ in group)]
+    parts = [f'<h1>{html.escape(title)}</h1>', f'<p class="meta">篇數 {n}・產生於 {datetime.now():%Y-%m-%d %H:%M}</p>']
+
+    for period, label in PERIODS:
+        totals = {}
+        for k, c in group:
+            r, e, cnt = totals.get(k[2], (0, 0, 0))
+            totals[k[2]] = (r + c['totals'][period][0], e + c['totals'][period][1], cnt + c['n'])
+        stats = core.platform_stats_from_totals(totals, n)
+        parts += [f'<h2>🏆 各平台成效 ({label})</h2>', html_table(list(stats[0].keys()), [list(s.values()) for s in stats])]
+
+    # 類型分佈 (同 type_crosstab：平台 × 類型，含總計)
+    types = []
+    for _, c in group: types += [t for t in c['types'] if t not in types]
+    grid = {pf: {t: sum(c['types'].get(t, 0) for k, c in group if k[2] == pf) for t in types} for pf in pfs}
+    rows = [[pf] + [grid[pf][t] for t in types] + [sum(grid[pf].values())] for pf in pfs]
+    rows.append(["總計"] + [sum(grid[pf][t] for pf in pfs) for t in types] + [n])
+    parts += ['<h2>🍰 類型分佈</h2>', html_table(["平台"] + types + ["總計"], rows)]
+
+    for period, label in PERIODS:
+        dist = {pf: {} for pf in pfs}
+        for k, c in group:
+            for lb, cnt in c['kpi'][period].items(): dist[k[2]][lb] = dist[k[2]].get(lb, 0) + cnt
+        labels = []
+        for pf in pfs: labels += [lb for lb in dist[pf] if lb not in labels]
+        parts += [f'<h2>🎯 KPI 分級 ({label})</h2>', html_table(["平台"] + labels, [[pf] + [dist[pf].get(lb, 0) for lb in labels] for pf in pfs])]
+
+    missing = sorted(m for _, c in group for m in c['missing'])
+    parts += [f'<h2>🔔 缺數據清單 ({len(missing)})</h2>', html_table(["日期", "平台", "主題", "貼文負責人", "美編", "缺7天", "缺30天"], missing)]
+    return title, n, f'<!DOCTYPE html><html lang="zh-Hant"><head><meta charset="utf-8"><title>{html.escape(title)}</title><style>{REPORT_CSS}</style></head><body>{"".join(parts)}</body></html>'
+
+def render_month(month, cells):
+    # 一個月份的所有組合 (含「全部」)；沒有貼文的組合不產生
+    owners = [ALL] + sorted({k[0] for k in cells})
+    designers = [ALL] + sorted({k[1] for k in cells})
+    platforms = [ALL] + [pf for pf in core.PLATFORMS if any(k[2] == pf for k in cells)]
+    out = []
+    for combo in product(owners, designers, platforms):
+        group = [(k, c) for k, c in cells.items() if all(want == ALL or want == got for want, got in zip(combo, k))]
+        if not group: continue
+        title, n, body = render_report(month, combo, group)
+        out.append((f"{month}/{'__'.join(slug(v) for v in combo)}.html", title, n, body))
+    return out
+
+def render_index(reports, elapsed):
+    months = {}
+    for path, title, n, _ in reports: months.setdefault(path.split('/')[0], []).append((path, title, n))
+    parts = [f'<h1>📑 KPI 月報索引</h1><p class="meta">{len(reports)} 份報表・{elapsed:.1f} 秒・產生於 {datetime.now():%Y-%m-%d %H:%M}</p>']
+    for month, items in months.items():
+        links = ''.join(f'<li><a href="{html.escape(path)}">{html.escape(title.split("｜", 1)[-1])}</a> ({n})</li>' for path, title, n in items)
+        parts.append(f'<h2>{month}</h2><ul>{links}</ul>')
+    return f'<!DOCTYPE html><html lang="zh-Hant"><head><meta charset="utf-8"><title>KPI 月報索引</title><style>{REPORT_CSS}</style></head><body>{"".join(parts)}</body></html>'
+
+# --- 對外介面 ---
+def generate_reports(posts, standards, months, workers=None):
+    # 回傳 [(相對路徑, 標題, 篇數, html)]，最後一份為 index.html
+    t0 = time.perf_counter()
+    cells = build_cells(posts, standards, months)
+    jobs = [(m, cells[m]) for m in months if cells[m]]
+    reports = []; workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for m, c in jobs: reports += render_month(m, c)
+    else:
+        # spawn：App 端從背景執行緒呼叫，避免 fork 複製到其他執行緒持有的鎖
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            for chunk in pool.map(render_month, *zip(*jobs)): reports += chunk
+    reports.append(('index.html', 'KPI 月報索引', sum(c['n'] for m in cells.values() for c in m.values()), render_index(reports, time.perf_counter() - t0)))
+    return reports
+
+def write_reports(reports, out_dir):
+    for path, _, _, body in reports:
+        full = os.path.join(out_dir, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'w', encoding='utf-8') as f: f.write(body)
+    return os.path.join(out_dir, 'index.html')
+
+def build_report_zip(posts, standards, months, workers=None):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, _, _, body in generate_reports(posts, standards, months, workers): zf.writestr(path, body)
+    return buf.getvalue()